@@ -1,8 +1,6 @@
 import pygame
 import json
 import sys
-import tkinter
-from tkinter import messagebox
 
 
 def terminate():
@@ -16,6 +14,10 @@ def get_data(filename='data/level_data.json'):
 
 
 def show_alert(message: str, title="Alert"):
+    # Tk is only needed for this box, so it is not imported until the box is shown
+    import tkinter
+    from tkinter import messagebox
+
     root = tkinter.Tk()
     root.withdraw()
 
@@ -83,6 +83,28 @@ class World:
 
         self.sprite_groups = [self.player, self.blocks, self.obstacles, self.special_tiles]
 
+        # Retrying the level restores this instead of building the world again
+        self.initial_state = self.snapshot()
+
+    def snapshot(self):
+        """Return the state that changes while the level is played."""
+        # Tiles are scrolled by moving them, so their positions change as well as the player's
+        tiles = [(sprite, sprite.rect.topleft, getattr(sprite, 'on', None))
+                 for group in self.sprite_groups[1:] for sprite in group]
+        return self.player.snapshot(), tiles
+
+    def restore(self, state):
+        player_state, tiles = state
+        self.player.restore(player_state)
+        for sprite, position, on in tiles:
+            sprite.rect.topleft = position
+            if on is not None:
+                sprite.on = on
+
+    def reset(self):
+        """Put the level back the way it was when it was built."""
+        self.restore(self.initial_state)
+
     def _check_data(self):
         """Check if data can be processed."""
         length = 0
@@ -128,12 +150,22 @@ class Player(pygame.sprite.Sprite):
         self.jump_height = 11
         self.gravity = 0.75
         self.game_over = False
+        self.result = None
         self.level = level
 
     def draw(self):
         self.screen.blit(self.image, self.rect)
         self.screen.blit(self.inner_image, self.inner_image_rect)
 
+    def snapshot(self):
+        return (self.rect.x, self.rect.y, self.vel_y, self.speed, self.jump_height, self.gravity,
+                self.in_air, self.jump, self.portal_jump, self.game_over, self.result)
+
+    def restore(self, state):
+        (self.rect.x, self.rect.y, self.vel_y, self.speed, self.jump_height, self.gravity,
+         self.in_air, self.jump, self.portal_jump, self.game_over, self.result) = state
+        self._position_inner_image()
+
     def _position_inner_image(self):
         self.inner_image_rect.width = self.rect.width - 4
         self.inner_image_rect.height = self.rect.height - 4
@@ -195,16 +227,13 @@ class Player(pygame.sprite.Sprite):
             global pause
             pause = True
         else:
-            global level
-            set_level(level, data)
+            # set_level's loop ends and the level is played again
+            self.result = False
+            self.game_over = True
 
     def level_up(self):
-        try:
-            global level
-            level += 1
-            set_level(level, data)
-        except IndexError:
-            self.win()
+        self.result = True
+        self.game_over = True
 
     def check_special_tile_attributes(self, sprite):
         if sprite.on is True:
@@ -223,9 +252,6 @@ class Player(pygame.sprite.Sprite):
                 self._check_if_jump()
             sprite.on = False
 
-    def win(self):
-        run_end()
-
     def _block_fall(self, sprite):
         self.vel_y = 0
         self.in_air = False
@@ -331,11 +357,25 @@ class Portal(pygame.sprite.Sprite):
         pygame.draw.circle(self.screen, e.colors[self.color], self.rect.center, self.rect.width / 2)
 
 
-def set_level(level: int, data: list):
-    level_data = data[level - 1]
-    world = World(screen, TILE_SIZE, level_data)
+def set_level(world: World):
+    world.reset()
     while world.player.game_over is False:
         run(world.sprite_groups, world.player)
+    return world.player.result
+
+
+def play_level(level_number: int):
+    global level
+    level = level_number
+    try:
+        world = World(screen, TILE_SIZE, data[level - 1])
+    except IndexError:
+        # There are no more levels
+        return run_end,
+    # Retrying after a death puts the same world back as it was, instead of building it again
+    while not set_level(world):
+        pass
+    return play_level, level + 1
 
 
 def run(sprite_groups, player):
@@ -425,11 +465,11 @@ def run_intro():
     global main_menu
     main_menu = True
 
-    def terminate(redo=False):
+    def terminate(*transition):
         global main_menu
         main_menu = False
         pygame.quit()
-        return redo
+        return transition
 
     screen_rect = screen.get_rect()
 
@@ -465,9 +505,9 @@ Get to the last level for the gravity challenge.
         title.draw()
         if instructions_btn.draw():
             e.show_alert(instructions, "How To Play")
-            return terminate(True)
+            return terminate(run_intro)
         if start_btn.draw():
-            return terminate()
+            return terminate(game)
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -499,7 +539,7 @@ def run_end():
 
         credits.draw()
         if play_again_btn.draw():
-            game()
+            return game,
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -522,7 +562,21 @@ def game():
     global data
     screen = setup_screen()
     level = START_LEVEL
-    set_level(level, data)
+    return play_level, level
+
+
+def run_scenes(scene, *args):
+    """Run scenes one after another until one of them quits.
+
+    A scene is a function that runs until it is finished and returns the next scene and its arguments,
+    or None to quit. Scenes never call each other, so the stack does not grow with every death or
+    level.
+    """
+    transition = (scene,) + args
+    while transition is not None:
+        scene, *args = transition
+        transition = scene(*args)
+    e.terminate()
 
 
 if __name__ == '__main__':
@@ -552,9 +606,4 @@ if __name__ == '__main__':
     if max_height * TILE_SIZE > SCREEN_HEIGHT:
         SCREEN_HEIGHT = max_height * TILE_SIZE
 
-    # Intro
-    redo = True
-    while redo:
-        redo = run_intro()
-    # Game
-    game()
+    run_scenes(run_intro)
@@ -0,0 +1,325 @@
+"""Step many runs of one level at once with NumPy.
+
+Usage: python batch.py [--runs N] [--ticks T] [--rate P] [--seed S] [LEVEL ...]
+"""
+import argparse
+
+import numpy as np
+
+import geometry_dash_1_1 as gd
+
+# Tile groups, in the order Player.update checks them
+BLOCK = 0
+OBSTACLE = 1
+PORTAL = 2
+
+# Player.result as a number: still running, died or won
+RUNNING = -1
+DIED = 0
+WON = 1
+
+# Per tick inputs: space released, pressed or left alone
+RELEASE = 0
+PRESS = 1
+NO_CHANGE = -1
+
+ACTIONS = {'f': 0, 'd': 1, 'g': 2, 'j': 3}
+
+
+def _truncate(values):
+    # pygame.Rect(...) truncates float coordinates
+    return np.trunc(values).astype(np.int64)
+
+
+def _round(values):
+    # Assigning a float to a pygame.Rect attribute rounds half away from zero
+    return (np.sign(values) * np.floor(np.abs(values) + 0.5)).astype(np.int64)
+
+
+class LevelGrid:
+    # The tiles of a World as arrays indexed by [row, column]. Each cell holds the group of its tile
+    #   (-1 for blank space) and the tile's collision rect in world coordinates, taken from the World's
+    #   own sprites so spikes, lava and portals keep exactly the rects Player.update sees.
+    def __init__(self, world):
+        height = world.data.height
+        width = world.data.width
+        self.tile_size = world.tile_size
+        self.group = np.full((height, width), -1, np.int8)
+        self.left = np.zeros((height, width), np.int64)
+        self.top = np.zeros((height, width), np.int64)
+        self.right = np.zeros((height, width), np.int64)
+        self.bottom = np.zeros((height, width), np.int64)
+        self.action = np.full((height, width), -1, np.int8)
+        self.portal = np.full((height, width), -1, np.int64)
+        # The portal sprites, by their number in self.portal
+        self.portals = []
+
+        portal_count = 0
+        for (x, y), tiles in world.collisions.cells.items():
+            for group, order, sprite in tiles:
+                self.group[y, x] = group
+                self.left[y, x] = sprite.rect.left
+                self.top[y, x] = sprite.rect.top
+                self.right[y, x] = sprite.rect.right
+                self.bottom[y, x] = sprite.rect.bottom
+                if group == PORTAL:
+                    self.action[y, x] = ACTIONS[sprite.action]
+                    self.portal[y, x] = portal_count
+                    self.portals.append(sprite)
+                    portal_count += 1
+        self.portal_count = portal_count
+
+
+class BatchSimulation:
+    # Runs n players through the same level together. Each player's state is a slot in the arrays
+    #   below and every tick is applied to all running players at once, following Player.update:
+    #   blocks, then obstacles, then portals, each in the order the level was built.
+    # Player.update sweeps moves longer than the player, or splits them when max_step is set, instead of
+    #   testing the probe rects. A player making such a move takes that tick through Player.update
+    #   itself, on self.world restored to its state, so the results stay exactly the same.
+    # bottom is where players die falling, as for World.
+    def __init__(self, data: list, n: int, tile_size=gd.TILE_SIZE, bottom=None):
+        world = gd.World(None, tile_size, data, bottom)
+        player = world.player
+        self.world = world
+        self.grid = LevelGrid(world)
+        self.n = n
+        self.tick = 0
+        self.world_bottom = world.bottom
+        self.width = player.rect.width
+        self.height = player.rect.height
+
+        self.x = np.full(n, player.rect.x, np.int64)
+        self.y = np.full(n, player.rect.y, np.int64)
+        self.vel_y = np.full(n, player.vel_y, np.float64)
+        self.speed = np.full(n, player.speed, np.int64)
+        self.gravity = np.full(n, player.gravity, np.float64)
+        self.jump_height = np.full(n, player.jump_height, np.float64)
+        self.in_air = np.full(n, player.in_air, bool)
+        self.jump = np.full(n, player.jump, bool)
+        self.portal_jump = np.full(n, player.portal_jump, bool)
+        self.spent = np.zeros((n, self.grid.portal_count), bool)
+
+        self.result = np.full(n, RUNNING, np.int8)
+        self.end_tick = np.full(n, -1, np.int64)
+        self.max_x = self.x.copy()
+
+    def step(self, jump=None):
+        """Advance every running player one tick. jump holds one RELEASE/PRESS/NO_CHANGE per player."""
+        active = np.flatnonzero(self.result == RUNNING)
+        if len(active) == 0:
+            return
+        if jump is not None:
+            jump = np.asarray(jump)[active]
+            self.jump[active] = np.where(jump == NO_CHANGE, self.jump[active], jump == PRESS)
+
+        fast = self._moves_fast(active)
+        if fast.any():
+            self._step_players(active[fast])
+            active = active[~fast]
+        if len(active):
+            self._step_probes(active)
+        self.tick += 1
+        self.end_tick[(self.result != RUNNING) & (self.end_tick < 0)] = self.tick
+
+    def _moves_fast(self, active):
+        # Whether Player.update would sweep or split the player's move this tick
+        jumping = self.jump[active] & (~self.in_air[active] | self.portal_jump[active])
+        vel_y = np.where(jumping, self.jump_height[active] * -1, self.vel_y[active]) + self.gravity[active]
+        longest = np.maximum(np.abs(self.speed[active]), np.abs(vel_y))
+        fast = longest > min(self.width, self.height)
+        if self.world.player.max_step:
+            fast |= longest > self.world.player.max_step
+        return fast
+
+    def _step_players(self, players):
+        # One tick of Player.update for each of these players, one at a time
+        world = self.world
+        player = world.player
+        for i in players:
+            spent = frozenset(self.grid.portals[k] for k in np.flatnonzero(self.spent[i]))
+            world.restore(gd.WorldState(gd.PlayerState(
+                int(self.x[i]), int(self.y[i]), float(self.vel_y[i]), int(self.speed[i]),
+                float(self.jump_height[i]), float(self.gravity[i]), bool(self.in_air[i]), bool(self.jump[i]),
+                bool(self.portal_jump[i]), None), spent))
+            player.update()
+            self.x[i] = player.rect.x
+            self.y[i] = player.rect.y
+            self.vel_y[i] = player.vel_y
+            self.speed[i] = player.speed
+            self.gravity[i] = player.gravity
+            self.jump_height[i] = player.jump_height
+            self.in_air[i] = player.in_air
+            self.jump[i] = player.jump
+            self.portal_jump[i] = player.portal_jump
+            self.spent[i] = [portal in world.collisions.spent_portals for portal in self.grid.portals]
+            self.result[i] = {None: RUNNING, False: DIED, True: WON}[player.result]
+            self.max_x[i] = max(self.max_x[i], player.rect.x)
+
+    def _step_probes(self, active):
+        # One tick for all these players at once, testing the probe rects as Player.update does for
+        #   short moves
+        x = self.x[active]
+        y = self.y[active]
+        vel_y = self.vel_y[active]
+        speed = self.speed[active]
+        gravity = self.gravity[active]
+        jump_height = self.jump_height[active]
+        in_air = self.in_air[active]
+        jump = self.jump[active]
+        portal_jump = self.portal_jump[active]
+        spent = self.spent[active]
+        result = self.result[active]
+        touched = np.zeros_like(spent)
+
+        self._check_if_jump(np.ones(len(active), bool), jump, in_air, portal_jump, vel_y, jump_height)
+
+        dx = speed.copy()
+        vel_y += gravity
+        dy = vel_y.copy()
+
+        # The two probe rects of Player.update
+        x_left = x + dx
+        y_top = _truncate(y + dy)
+        in_air[:] = True
+
+        tile_size = self.grid.tile_size
+        rows, columns = self.grid.group.shape
+        left = np.minimum(x, x_left)
+        right = np.maximum(x, x_left) + self.width
+        top = np.minimum(y, y_top)
+        bottom = np.maximum(y, y_top) + self.height
+        first_column = left // tile_size
+        last_column = (right - 1) // tile_size
+        first_row = top // tile_size
+        last_row = (bottom - 1) // tile_size
+        row_span = int((last_row - first_row).max()) + 1
+        column_span = int((last_column - first_column).max()) + 1
+
+        for group in (BLOCK, OBSTACLE, PORTAL):
+            for i in range(row_span):
+                row = first_row + i
+                for j in range(column_span):
+                    column = first_column + j
+                    inside = ((row <= last_row) & (column <= last_column) &
+                              (row >= 0) & (row < rows) & (column >= 0) & (column < columns))
+                    r = np.where(inside, row, 0)
+                    c = np.where(inside, column, 0)
+                    hit = inside & (self.grid.group[r, c] == group)
+                    if not hit.any():
+                        continue
+
+                    tile_left = self.grid.left[r, c]
+                    tile_top = self.grid.top[r, c]
+                    tile_right = self.grid.right[r, c]
+                    tile_bottom = self.grid.bottom[r, c]
+                    x_hit = hit & ((x_left < tile_right) & (tile_left < x_left + self.width) &
+                                   (y < tile_bottom) & (tile_top < y + self.height))
+                    y_hit = hit & ~x_hit & ((x < tile_right) & (tile_left < x + self.width) &
+                                            (y_top < tile_bottom) & (tile_top < y_top + self.height))
+
+                    if group == BLOCK:
+                        result[x_hit] = DIED
+                        normal = gravity > 0
+                        block_jump = y_hit & normal & (vel_y < 0)
+                        block_fall = y_hit & normal & (vel_y >= 0)
+                        block_reverse_fall = y_hit & ~normal & (vel_y <= 0)
+                        block_reverse_jump = y_hit & ~normal & (vel_y > 0)
+                        dy = np.where(block_jump, tile_bottom - y, dy)
+                        dy = np.where(block_fall, tile_top - (y + self.height), dy)
+                        dy = np.where(block_reverse_fall, y - tile_bottom, dy)
+                        dy = np.where(block_reverse_jump, tile_bottom - tile_top, dy)
+                        vel_y[y_hit] = 0
+                        in_air[block_fall | block_reverse_fall] = False
+                    elif group == OBSTACLE:
+                        result[x_hit | y_hit] = DIED
+                    else:
+                        hit = x_hit | y_hit
+                        portal = self.grid.portal[r, c]
+                        touched_at = np.flatnonzero(hit)
+                        touched[touched_at, portal[touched_at]] = True
+                        on = hit & ~spent[np.arange(len(active)), portal]
+                        action = self.grid.action[r, c]
+                        result[on & (action == ACTIONS['f'])] = WON
+                        speed[on & (action == ACTIONS['d'])] *= -1
+                        flip = on & (action == ACTIONS['g'])
+                        gravity[flip] *= -1
+                        jump_height[flip] *= -1
+                        jump_again = on & (action == ACTIONS['j'])
+                        portal_jump[jump_again] = True
+                        self._check_if_jump(jump_again, jump, in_air, portal_jump, vel_y, jump_height)
+                        spent_at = np.flatnonzero(on)
+                        spent[spent_at, portal[spent_at]] = True
+
+        # Portals switch back on as soon as the player stops touching them
+        spent &= touched
+
+        x += dx
+        y = _round(y + dy)
+        result[(y >= self.world_bottom) | (y + self.height < -200)] = DIED
+
+        self.x[active] = x
+        self.y[active] = y
+        self.vel_y[active] = vel_y
+        self.speed[active] = speed
+        self.gravity[active] = gravity
+        self.jump_height[active] = jump_height
+        self.in_air[active] = in_air
+        self.jump[active] = jump
+        self.portal_jump[active] = portal_jump
+        self.spent[active] = spent
+        self.result[active] = result
+        self.max_x[active] = np.maximum(self.max_x[active], x)
+
+    def run(self, inputs, max_ticks=None):
+        """Step through the rows of inputs (ticks x players), then without input, until every player
+        has finished or max_ticks."""
+        inputs = np.asarray(inputs)
+        while (self.result == RUNNING).any() and (max_ticks is None or self.tick < max_ticks):
+            self.step(inputs[self.tick] if self.tick < len(inputs) else None)
+        return self.result
+
+    def furthest_column(self):
+        return self.max_x // self.grid.tile_size
+
+    @staticmethod
+    def _check_if_jump(mask, jump, in_air, portal_jump, vel_y, jump_height):
+        jumping = mask & jump & (~in_air | portal_jump)
+        vel_y[jumping] = -jump_height[jumping]
+        jump[jumping] = False
+        in_air[jumping] = True
+        portal_jump[jumping] = False
+
+
+def random_inputs(n: int, ticks: int, rate=0.05, seed=None):
+    """Inputs where each player toggles space with probability rate every tick."""
+    rng = np.random.default_rng(seed)
+    toggles = rng.random((ticks, n)) < rate
+    held = np.cumsum(toggles, axis=0) % 2 == 1
+    return np.where(toggles, held.astype(np.int8), NO_CHANGE).astype(np.int8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play random inputs through levels in bulk.")
+    parser.add_argument('levels', nargs='*', type=int, help="level numbers, all levels by default")
+    parser.add_argument('--runs', type=int, default=1000)
+    parser.add_argument('--ticks', type=int, default=3000)
+    parser.add_argument('--rate', type=float, default=0.05, help="chance of toggling space each tick")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--data', default=None)
+    args = parser.parse_args()
+
+    data = gd.get_data(args.data)
+    levels = args.levels or range(1, len(data) + 1)
+    bottom = gd.screen_height(data)
+    for level in levels:
+        batch = BatchSimulation(data[level - 1], args.runs, bottom=bottom)
+        batch.run(random_inputs(args.runs, args.ticks, args.rate, args.seed), args.ticks)
+        columns = batch.furthest_column()
+        print(f"Level {level}: {np.mean(batch.result == WON):.1%} won, "
+              f"{np.mean(batch.result == DIED):.1%} died, "
+              f"median furthest column {int(np.median(columns))} of {len(data[level - 1][0])}")
+
+
+if __name__ == '__main__':
+    main()
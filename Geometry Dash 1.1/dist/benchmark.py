@@ -0,0 +1,190 @@
+"""Benchmark level loading, physics, drawing and whole frames.
+
+Runs on the SDL dummy video driver, so it needs no window. Results are saved as JSON so two runs can be
+compared.
+
+Usage: python benchmark.py [--data FILE] [--sizes N ...] [--repeat R] [--ticks T] [--frames F] [--out FILE]
+                           [--compare FILE]
+"""
+import argparse
+import json
+import os
+import platform
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+
+import geometry_dash_1_1 as gd
+
+SIZES = (10, 100, 1000, 10000)
+HEIGHT = 12
+
+
+def synthetic_level(columns: int, height=HEIGHT):
+    """Return a level of the given number of columns with the same mix of tiles all the way along.
+
+    There is a floor of blocks, with spikes, floating platforms and jump portals at fixed spacings, and
+    an end portal in the last column.
+    """
+    rows = [[-1] * columns for _ in range(height)]
+    floor = height - 1
+    for x in range(columns):
+        rows[floor][x] = 1 + x % 3
+        if x >= 10 and x % 7 == 0:
+            rows[floor - 1][x] = 4
+        if x % 25 == 12:
+            for platform_x in range(x, min(x + 4, columns)):
+                rows[floor - 4][platform_x] = 2
+        if x % 40 == 30:
+            rows[floor - 6][x] = 10
+    rows[floor - 1][0] = 0
+    rows[floor - 1][columns - 1] = 7
+    return rows
+
+
+def _inputs(tick: int):
+    # Hold space for a few ticks every 20, so the player jumps, lands and collides with things
+    return tick % 20 < 3
+
+
+def bench_world(screen, data, repeat: int):
+    """Seconds to build a World, the fastest of repeat builds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        gd.World(screen, gd.TILE_SIZE, data)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_update(screen, data, ticks: int):
+    """Mean seconds per Player.update over ticks ticks, restarting the level whenever it ends."""
+    simulation = gd.Simulation(data, world=gd.World(screen, gd.TILE_SIZE, data))
+    player = simulation.player
+    elapsed = 0
+    for tick in range(ticks):
+        if player.result is not None:
+            simulation.reset()
+        player.jump = _inputs(tick)
+        start = time.perf_counter()
+        player.update()
+        elapsed += time.perf_counter() - start
+    return elapsed / ticks
+
+
+def bench_draw(screen, data, frames: int):
+    """Mean seconds per World.draw while the camera sweeps along the level at the player's speed."""
+    world = gd.World(screen, gd.TILE_SIZE, data)
+    level_width = world.data.width * gd.TILE_SIZE
+    elapsed = 0
+    for frame in range(frames):
+        world.camera.x = (frame * world.player.speed) % max(level_width - screen.get_width(), 1)
+        screen.fill(gd.colors["Blue"])
+        start = time.perf_counter()
+        world.draw()
+        elapsed += time.perf_counter() - start
+    return elapsed / frames
+
+
+def bench_run(screen, data, frames: int):
+    """Frames per second of run(), restarting the level whenever it ends.
+
+    Frames are not waited for and each runs exactly one tick, with the offline pacing mode, so every
+    machine does the same work for the same frames.
+    """
+    simulation = gd.Simulation(data, world=gd.World(screen, gd.TILE_SIZE, data))
+    gd.pacer = gd.FramePacer(0, 'offline')
+    gd.inputs.reset()
+    start = time.perf_counter()
+    for frame in range(frames):
+        if simulation.player.result is not None:
+            simulation.reset()
+        simulation.player.jump = _inputs(simulation.tick)
+        gd.run(screen, simulation)
+    return frames / (time.perf_counter() - start)
+
+
+def run_benchmarks(screen, levels: dict, repeat: int, ticks: int, frames: int):
+    """Benchmark {name: level data} and return a list of result dicts."""
+    results = []
+    for name, data in levels.items():
+        columns = len(data[0])
+        tiles = sum(tile != -1 for row in data for tile in row)
+        measurements = [
+            ('world_build', bench_world(screen, data, repeat) * 1000, 'ms'),
+            ('player_update', bench_update(screen, data, ticks) * 1000000, 'us'),
+            ('world_draw', bench_draw(screen, data, frames) * 1000, 'ms'),
+            ('run', bench_run(screen, data, frames), 'fps'),
+        ]
+        for benchmark, value, unit in measurements:
+            results.append({'benchmark': benchmark, 'level': name, 'columns': columns, 'tiles': tiles,
+                            'value': value, 'unit': unit})
+        print(f"{name:<16}{columns:>7} columns {tiles:>7} tiles  " +
+              "  ".join(f"{benchmark} {value:.3f} {unit}" for benchmark, value, unit in measurements))
+    return results
+
+
+def compare(old: dict, new: dict):
+    """Print how each result in new changed from the same result in old."""
+    old_values = {(result['benchmark'], result['level']): result['value'] for result in old['results']}
+    print(f"{'benchmark':<16}{'level':<16}{'old':>12}{'new':>12}{'change':>9}")
+    for result in new['results']:
+        key = (result['benchmark'], result['level'])
+        if key not in old_values:
+            continue
+        old_value = old_values[key]
+        change = (result['value'] - old_value) / old_value if old_value else 0
+        print(f"{result['benchmark']:<16}{result['level']:<16}{old_value:>12.3f}{result['value']:>12.3f}"
+              f"{change:>+9.1%} {result['unit']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the game headlessly.")
+    parser.add_argument('--data', default=None)
+    parser.add_argument('--sizes', nargs='*', type=int, default=SIZES,
+                        help="column counts of the synthetic levels")
+    parser.add_argument('--repeat', type=int, default=5, help="World builds per level, the fastest is kept")
+    parser.add_argument('--ticks', type=int, default=3000, help="Player.update ticks per level")
+    parser.add_argument('--frames', type=int, default=300, help="frames drawn per level")
+    parser.add_argument('--out', help="save the results to this JSON file")
+    parser.add_argument('--compare', metavar='FILE', help="compare the results with an earlier JSON file")
+    args = parser.parse_args()
+
+    levels = {f"level {number}": level for number, level in enumerate(gd.get_data(args.data), 1)}
+    for columns in args.sizes:
+        levels[f"synthetic {columns}"] = synthetic_level(columns)
+
+    gd.SCREEN_HEIGHT = max(gd.SCREEN_HEIGHT, max(len(level) for level in levels.values()) * gd.TILE_SIZE)
+    screen = gd.setup_screen()
+
+    results = {
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'args': vars(args),
+        'results': run_benchmarks(screen, levels, args.repeat, args.ticks, args.frames),
+    }
+
+    # How each benchmark grows with the length of the synthetic levels
+    synthetic = [result for result in results['results'] if result['level'].startswith('synthetic')]
+    for benchmark in ('world_build', 'player_update', 'world_draw', 'run'):
+        points = [(result['columns'], result['value']) for result in synthetic if result['benchmark'] == benchmark]
+        if len(points) > 1:
+            ratios = [value / points[0][1] for columns, value in points]
+            print(f"{benchmark} relative to {points[0][0]} columns: " +
+                  ", ".join(f"{columns}: {ratio:.2f}x" for (columns, value), ratio in zip(points, ratios)))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(json.load(f), results)
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
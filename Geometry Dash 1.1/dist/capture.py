@@ -0,0 +1,136 @@
+"""Render replayed runs without a window, and export them as image sequences or raw video.
+
+Usage: python capture.py LEVEL --inputs FILE [--data FILE] [--out PATH] [--workers W] [--max-ticks T]
+
+--inputs is a JSON file of {level: inputs}, such as the one solver.py --out writes.
+--out is a pattern such as frames/%05d.png for an image sequence, or a .rgba file or - (stdout) for raw
+video of 4 bytes per pixel (red, green, blue, unused), which ffmpeg can read with:
+    ffmpeg -f rawvideo -pix_fmt rgb0 -s WIDTHxHEIGHT -r 60 -i clip.rgba clip.mp4
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+# pygame's greeting would end up in raw video written to stdout
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np
+import pygame
+
+import geometry_dash_1_1 as gd
+
+
+class FrameCapture:
+    # An offscreen surface for run() to draw into instead of the window. Its pixels live in a NumPy
+    #   array the surface was made over with pygame.image.frombuffer, so reading a frame needs no
+    #   copy and, unlike pygame.surfarray.pixels3d, does not lock the surface while the view exists.
+    # self.pixels is (height, width, 4) RGBX, row by row like a video frame; self.frame is the RGB part
+    #   of it. Both change in place every time a frame is drawn.
+    def __init__(self, width=None, height=None):
+        width = gd.SCREEN_WIDTH if width is None else width
+        height = gd.SCREEN_HEIGHT if height is None else height
+        self.pixels = np.zeros((height, width, 4), np.uint8)
+        self.frame = self.pixels[:, :, :3]
+        self.surface = pygame.image.frombuffer(self.pixels, (width, height), 'RGBX')
+
+    @property
+    def size(self):
+        return self.surface.get_size()
+
+
+def replay_frames(capture, data, inputs, max_ticks=None):
+    """Replay a level from per tick inputs into capture, yielding after each frame is drawn.
+
+    One frame is drawn per tick, through run() with the offline pacing mode, until the level ends or
+    max_ticks. Inputs are the same as Simulation.run's.
+    """
+    gd.pacer = gd.FramePacer(mode='offline')
+    gd.inputs.reset()
+    simulation = gd.Simulation(data, world=gd.World(capture.surface, gd.TILE_SIZE, data))
+    inputs = iter(inputs)
+    while simulation.player.result is None and (max_ticks is None or simulation.tick < max_ticks):
+        jump = next(inputs, None)
+        if jump is not None:
+            simulation.player.jump = jump
+        gd.run(capture.surface, simulation)
+        yield simulation
+
+
+def _save_image(job):
+    # Runs in a worker process: encode one frame and save it
+    pixels, size, filename = job
+    pygame.image.save(pygame.image.frombuffer(pixels, size, 'RGBX'), filename)
+    return filename
+
+
+def export_images(capture, frames, pattern: str, workers=None, in_flight=None):
+    """Save each frame as an image named pattern % frame number, encoding in a process pool.
+
+    The image format comes from the extension, as with pygame.image.save. At most in_flight frames wait
+    to be encoded at once, so memory stays bounded however long the replay is.
+    """
+    directory = os.path.dirname(pattern)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    in_flight = in_flight or 4 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        count = 0
+        for _ in frames:
+            # The frame has to be copied once to reach another process
+            job = (capture.pixels.tobytes(), capture.size, pattern % count)
+            pending.append(executor.submit(_save_image, job))
+            count += 1
+            if len(pending) >= in_flight:
+                pending.pop(0).result()
+        for future in pending:
+            future.result()
+    return count
+
+
+def export_raw(capture, frames, out):
+    """Write each frame's RGBX pixels to a binary file object, as raw video with no copying."""
+    count = 0
+    for _ in frames:
+        out.write(memoryview(capture.pixels).cast('B'))
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a replayed run to images or raw video.")
+    parser.add_argument('level', type=int)
+    parser.add_argument('--inputs', required=True, help="JSON file of {level: inputs}")
+    parser.add_argument('--data', default=None)
+    parser.add_argument('--out', default='frames/%05d.png')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-ticks', type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.inputs, 'r') as f:
+        inputs = json.load(f)[str(args.level)]
+    data = gd.get_data(args.data)
+    level_data = data[args.level - 1]
+    gd.SCREEN_HEIGHT = gd.screen_height(data)
+
+    # run() polls events, which needs the display set up even though nothing is drawn to it
+    gd.setup_screen()
+    capture = FrameCapture()
+    frames = replay_frames(capture, level_data, inputs, args.max_ticks)
+    if args.out == '-':
+        count = export_raw(capture, frames, sys.stdout.buffer)
+    elif args.out.endswith(('.rgba', '.raw')):
+        with open(args.out, 'wb') as f:
+            count = export_raw(capture, frames, f)
+    else:
+        count = export_images(capture, frames, args.out, args.workers)
+    width, height = capture.size
+    print(f"Wrote {count} {width}x{height} frames to {args.out}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
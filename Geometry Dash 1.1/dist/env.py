@@ -0,0 +1,261 @@
+"""A Gym-style environment for training agents on the levels, and a vectorized version that runs many
+environments across processes.
+
+Measure steps per second with random actions:
+    python env.py [--data FILE] [--envs N] [--workers W] [--steps S] [LEVEL ...]
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import geometry_dash_1_1 as gd
+from levels import BLANK
+
+# Actions: release space or hold it
+RELEASE = 0
+JUMP = 1
+
+STATE_FIELDS = ('vel_y', 'gravity', 'speed', 'in_air', 'x_offset', 'y_offset')
+
+
+class GeometryDashEnv:
+    # Plays one level at a time through a headless Simulation, one tick per step.
+    # Actions hold or release space, as the keyboard does: holding JUMP is one press and one jump, and
+    #   the player jumps again only after a RELEASE, not on every tick or landing while it is held.
+    # Observations are a dict of:
+    # tiles: the (2 * radius[0] + 1, 2 * radius[1] + 1) window of tiles around the player's tile, with
+    #   blank space beyond the edges of the level. The player itself is not in it.
+    # state: the STATE_FIELDS of the player as float32. The offsets are where the player is inside its
+    #   tile, from 0 to 1, since the window only moves a whole tile at a time.
+    # Each step is rewarded with the tiles travelled, win_reward for reaching an end portal and
+    #   death_reward for dying. An episode is truncated after max_ticks.
+    # The player dies on falling past bottom, by default the bottom of the window the game would open for
+    #   these levels.
+    def __init__(self, data=None, radius=(5, 10), max_ticks=3000, win_reward=100.0, death_reward=-10.0,
+                 bottom=None):
+        # data is the levels, or a file name to load them from with get_data
+        if data is None or isinstance(data, str):
+            data = gd.get_data(data)
+        self.data = data
+        self.bottom = gd.screen_height(data) if bottom is None else bottom
+        self.radius = radius
+        self.max_ticks = max_ticks
+        self.win_reward = win_reward
+        self.death_reward = death_reward
+        self.tiles_shape = (2 * radius[0] + 1, 2 * radius[1] + 1)
+        self.state_shape = (len(STATE_FIELDS),)
+        # Level number: (simulation, tiles padded by radius on every side). Worlds are kept and reset,
+        #   not built again, so resetting is cheap.
+        self.levels = {}
+        self.level = None
+        self.simulation = None
+        self.padded = None
+        self.x = 0
+        self.action = RELEASE
+
+    def _load(self, level: int):
+        if level not in self.levels:
+            if level < 1:
+                raise IndexError(level)
+            simulation = gd.Simulation(self.data[level - 1], bottom=self.bottom)
+            world = simulation.world
+            tiles = np.full((world.data.height, world.data.width), BLANK, np.int8)
+            for x, y, tile in world.data.tiles():
+                if tile != 0:
+                    tiles[y, x] = tile
+            padded = np.pad(tiles, ((self.radius[0],) * 2, (self.radius[1],) * 2), constant_values=BLANK)
+            self.levels[level] = (simulation, padded)
+        return self.levels[level]
+
+    def reset(self, level=None):
+        """Start a level again, the current one if level is None. Returns (observation, info)."""
+        if level is None:
+            level = self.level or gd.START_LEVEL
+        self.level = level
+        self.simulation, self.padded = self._load(level)
+        self.simulation.reset()
+        self.x = self.simulation.player.rect.x
+        self.action = RELEASE
+        return self.observe(), self._info()
+
+    def step(self, action: int):
+        """Hold (JUMP) or release (RELEASE) space for one tick.
+
+        Returns (observation, reward, terminated, truncated, info).
+        """
+        player = self.simulation.player
+        # Only a change of action is a key press or release
+        jump = None
+        if action != self.action:
+            jump = action == JUMP
+            self.action = action
+        result = self.simulation.step(jump)
+        reward = abs(player.rect.x - self.x) / self.simulation.world.tile_size
+        self.x = player.rect.x
+        if result is True:
+            reward += self.win_reward
+        elif result is False:
+            reward += self.death_reward
+        terminated = result is not None
+        truncated = not terminated and self.simulation.tick >= self.max_ticks
+        return self.observe(), reward, terminated, truncated, self._info()
+
+    def observe(self, tiles=None, state=None):
+        """Return the observation, written into the tiles and state arrays if they are given."""
+        if tiles is None:
+            tiles = np.empty(self.tiles_shape, np.int8)
+        if state is None:
+            state = np.empty(self.state_shape, np.float32)
+        player = self.simulation.player
+        tile_size = self.simulation.world.tile_size
+        # The player's tile, clamped so the window stays inside the padding
+        rows, columns = self.padded.shape
+        row = min(max(player.rect.centery // tile_size, 0), rows - self.tiles_shape[0])
+        column = min(max(player.rect.centerx // tile_size, 0), columns - self.tiles_shape[1])
+        tiles[:] = self.padded[row:row + self.tiles_shape[0], column:column + self.tiles_shape[1]]
+        state[:] = (player.vel_y, player.gravity, player.speed, player.in_air,
+                    player.rect.x % tile_size / tile_size, player.rect.y % tile_size / tile_size)
+        return {'tiles': tiles, 'state': state}
+
+    def _info(self):
+        player = self.simulation.player
+        return {'level': self.level, 'tick': self.simulation.tick, 'x': player.rect.x, 'result': player.result}
+
+
+"""Vectorized"""
+
+
+def _worker(connection, indices, names, shapes, data, env_kwargs):
+    # Runs the environments at indices and writes their observations straight into the shared arrays
+    memories = [shared_memory.SharedMemory(name=name) for name in names]
+    tiles = np.ndarray(shapes[0], np.int8, buffer=memories[0].buf)
+    state = np.ndarray(shapes[1], np.float32, buffer=memories[1].buf)
+    envs = [GeometryDashEnv(data, **env_kwargs) for _ in indices]
+    try:
+        while True:
+            command, arguments = connection.recv()
+            if command == 'reset':
+                infos = []
+                for env, index, level in zip(envs, indices, arguments):
+                    infos.append(env.reset(level)[1])
+                    env.observe(tiles[index], state[index])
+                connection.send(infos)
+            elif command == 'step':
+                results = []
+                for env, index, action in zip(envs, indices, arguments):
+                    observation, reward, terminated, truncated, info = env.step(action)
+                    if terminated or truncated:
+                        # Start the level again straight away, like Gym's vector environments
+                        env.reset()
+                    env.observe(tiles[index], state[index])
+                    results.append((reward, terminated, truncated, info))
+                connection.send(results)
+            elif command == 'close':
+                break
+    finally:
+        del tiles, state
+        for memory in memories:
+            memory.close()
+
+
+class VectorEnv:
+    # Runs n GeometryDashEnvs in a pool of worker processes, each owning a share of them.
+    # Observations are written by the workers into shared memory, so reset() and step() return NumPy
+    #   views with a leading n axis without copying or pickling them. The views are overwritten by the
+    #   next step, so copy them to keep them.
+    # An environment whose episode ends is reset straight away; step() still reports the reward,
+    #   terminated, truncated and info of the step that ended it, and the observation is the new start.
+    def __init__(self, n: int, levels=None, workers=None, data=None, **env_kwargs):
+        # data is a file name for get_data, since each worker loads the levels itself
+        self.n = n
+        self.levels = list(levels or [gd.START_LEVEL])
+        probe = GeometryDashEnv(data, **env_kwargs)
+        # Passed on so the workers do not have to work it out from the levels again
+        env_kwargs['bottom'] = probe.bottom
+        shapes = ((n,) + probe.tiles_shape, (n,) + probe.state_shape)
+        self.memories = [shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * size, 1))
+                         for shape, size in zip(shapes, (1, 4))]
+        self.tiles = np.ndarray(shapes[0], np.int8, buffer=self.memories[0].buf)
+        self.state = np.ndarray(shapes[1], np.float32, buffer=self.memories[1].buf)
+
+        workers = min(n, workers or os.cpu_count() or 1)
+        self.shares = [indices.tolist() for indices in np.array_split(np.arange(n), workers)]
+        self.connections = []
+        self.processes = []
+        for indices in self.shares:
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker, daemon=True, args=(
+                child, indices, [memory.name for memory in self.memories], shapes, data, env_kwargs))
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def reset(self, levels=None):
+        """Start every environment, environment i on levels[i]. By default the levels given to the
+        constructor are dealt out in turn. Returns (observations, infos)."""
+        if levels is None:
+            levels = [self.levels[i % len(self.levels)] for i in range(self.n)]
+        for connection, indices in zip(self.connections, self.shares):
+            connection.send(('reset', [levels[i] for i in indices]))
+        infos = [info for connection in self.connections for info in connection.recv()]
+        return {'tiles': self.tiles, 'state': self.state}, infos
+
+    def step(self, actions):
+        """Step every environment with its action. Returns (observations, rewards, terminated,
+        truncated, infos)."""
+        actions = np.asarray(actions)
+        for connection, indices in zip(self.connections, self.shares):
+            connection.send(('step', actions[indices].tolist()))
+        results = [result for connection in self.connections for result in connection.recv()]
+        rewards, terminated, truncated, infos = zip(*results)
+        return ({'tiles': self.tiles, 'state': self.state}, np.array(rewards, np.float32),
+                np.array(terminated), np.array(truncated), list(infos))
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(('close', None))
+        for process in self.processes:
+            process.join()
+        del self.tiles, self.state
+        for memory in self.memories:
+            memory.close()
+            memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure environment steps per second with random actions.")
+    parser.add_argument('levels', nargs='*', type=int, help="level numbers, level 1 by default")
+    parser.add_argument('--data', default=None)
+    parser.add_argument('--envs', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--steps', type=int, default=1000, help="vector steps to run")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    with VectorEnv(args.envs, args.levels, args.workers, args.data) as env:
+        env.reset()
+        start = time.perf_counter()
+        episodes = 0
+        for _ in range(args.steps):
+            observations, rewards, terminated, truncated, infos = env.step(rng.integers(0, 2, args.envs))
+            episodes += int(terminated.sum() + truncated.sum())
+        elapsed = time.perf_counter() - start
+        steps = args.steps * args.envs
+        workers = len(env.processes)
+    print(f"{steps} steps in {elapsed:.2f} s: {steps / elapsed:,.0f} steps/s, "
+          f"{steps / elapsed / workers:,.0f} steps/s per worker, {episodes} episodes")
+
+
+if __name__ == '__main__':
+    main()
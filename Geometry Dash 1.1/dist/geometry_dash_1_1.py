@@ -1,36 +1,406 @@
+import time
+
+# Timed from here so the startup report includes the imports
+START_TIME = time.perf_counter()
+
 import pygame
+import os
+import math
 import sys
 import json
-import tkinter
-from tkinter import messagebox
+import csv
+import argparse
+import threading
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from levels import MANIFEST, LevelArchive, LevelPack, SparseLevel, open_levels
+
+"""Settings"""
+
+# Set screen width
+SCREEN_WIDTH = 600
+# Grown in __main__ to fit the tallest level
+SCREEN_HEIGHT = 600
+# Set other settings
+TILE_SIZE = 50
+
+# Set game settings
+pause = False
+show_debug = False  # Toggle with F3
+latency_report = False  # Print the input latency on quitting, set with --latency-report
+replay_dir = None  # Save a replay of every completed level here, set with --record
+ghost_dir = None  # Race the replays in this directory, set with --ghosts
+GHOST_COUNT = 100  # The fastest this many replays of a level are shown as ghosts
+stop = False
+START_LEVEL = 1  # Leave at 1 except for testing
+LEVEL_FILE = 'data/level_data.json'
+# Level packs levels.py can build from LEVEL_FILE, in the order they are preferred
+CONVERTED_LEVEL_FILES = ('data/levels.zip', 'data/levels', 'data/level_data.gdl')
+
+# Initialize clock
+clock = pygame.time.Clock()
+FPS = 60  # Frame rate the capped and busy pacing modes aim for
+PACING = 'capped'  # See FramePacer.modes
+# The physics runs at this many ticks a second whatever the frame rate. Player speeds and gravity are
+#   per tick, so changing it changes how fast the game plays.
+TICK_RATE = 60
+# Frames longer than this are cut short, so a stall does not have to be caught up with a burst of ticks
+MAX_FRAME_TIME = 0.25
+# Split a tick's move into sub-steps of at most this many pixels, or None to never split. Fast moves are
+#   swept either way, so nothing is passed through, but sub-steps also land and take portals part way.
+MAX_STEP = None
+# Milliseconds the menus sleep for at most while nothing happens
+MENU_TIMEOUT = 1000
 
 """Extras"""
 
 
 def setup_screen():
-    # Initialize screen
-    pygame.init()
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    # Initialize screen. Only the display and fonts are used, so the other subsystems (audio,
+    #   joysticks) are left off.
+    pygame.display.init()
+    pygame.font.init()
+    if pacer.mode == 'vsync':
+        # SDL only syncs to the display's refresh rate for scaled or OpenGL windows
+        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SCALED, vsync=1)
+    else:
+        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
     pygame.display.set_caption('Geometry Dash')
     return screen
 
 
 def terminate():
+    profiler.close()
+    if latency_report and inputs.latency:
+        print(f"Input latency over the last {len(inputs.latency)} jumps: "
+              f"p50 {inputs.percentile(50) * 1000:.1f} ms, p99 {inputs.percentile(99) * 1000:.1f} ms")
     pygame.quit()
     sys.exit()
 
 
-def get_data(filename='data/level_data.json'):
-    with open(filename, 'r') as f:
-        return json.load(f)
+def default_data_file():
+    # Prefer a level archive or a binary level pack built from LEVEL_FILE (see levels.py), since neither
+    #   has to be parsed up front. One older than LEVEL_FILE is out of date and would hide its changes.
+    if not os.path.exists(LEVEL_FILE):
+        return next((candidate for candidate in CONVERTED_LEVEL_FILES if os.path.exists(candidate)), LEVEL_FILE)
+    edited = os.path.getmtime(LEVEL_FILE)
+    for candidate in CONVERTED_LEVEL_FILES:
+        # A directory archive is as new as its manifest, which is written last
+        built = os.path.join(candidate, MANIFEST) if os.path.isdir(candidate) else candidate
+        if os.path.exists(built) and os.path.getmtime(built) >= edited:
+            return candidate
+    return LEVEL_FILE
+
+
+def get_data(filename=None):
+    # The game and every tool load default_data_file() unless told otherwise, so they all agree
+    if filename is None:
+        filename = default_data_file()
+    if filename.endswith('.json'):
+        with open(filename, 'r') as f:
+            data = json.load(f)
+    else:
+        data = open_levels(filename)
+    return data
 
 
-def show_alert(message: str, title="Alert"):
-    root = tkinter.Tk()
-    root.withdraw()
+def screen_height(data, minimum=SCREEN_HEIGHT):
+    """Return the window height that fits the tallest level in data.
 
-    # Message Box
-    messagebox.showinfo(title, message)
+    The player dies on falling past the bottom of the window, so the headless tools pass this to World
+    as bottom to die where the game would.
+    """
+    # Packs and archives know the height of their tallest level without reading the levels
+    if isinstance(data, (LevelPack, LevelArchive)):
+        max_height = data.max_height
+    else:
+        max_height = 0
+        for level_data in data:
+            height = len(level_data)
+            if height > max_height:
+                max_height = height
+    return max(minimum, max_height * TILE_SIZE)
+
+
+def draw_text(screen, text: str, x, y, color="White", size=24):
+    if size not in fonts:
+        fonts[size] = pygame.font.Font(None, size)
+    screen.blit(fonts[size].render(text, True, colors[color]), (x, y))
+
+
+class StartupReport:
+    # Records how long each step of startup takes. Printed when the game is run with --startup-report.
+    def __init__(self, start):
+        self.last = start
+        self.start = start
+        self.steps = []
+
+    def mark(self, step: str):
+        now = time.perf_counter()
+        self.steps.append((step, now - self.last))
+        self.last = now
+
+    def print(self):
+        for step, seconds in self.steps:
+            print(f"{step:<12}{seconds * 1000:8.1f} ms")
+        print(f"{'total':<12}{(self.last - self.start) * 1000:8.1f} ms")
+
+
+class FramePacer:
+    # Decides how long each frame waits and turns the time between frames into fixed physics ticks.
+    # Modes:
+    # capped: sleep in clock.tick until the next frame is due. Cheap, but only as precise as the OS
+    #   scheduler.
+    # busy: wait in clock.tick_busy_loop, which is precise but keeps a CPU core busy.
+    # vsync: let the display's refresh rate pace the frames. Chosen when the window is made, so it
+    #   can only be picked at startup.
+    # uncapped: draw frames as fast as possible.
+    # offline: do not wait, and count every frame as exactly one tick of game time. For rendering
+    #   replays faster than real time, where the frames have to come out the same on every run.
+    # Frame time is added to an accumulator and a tick is run for every 1 / tick_rate seconds of it.
+    #   What is left over is self.alpha, how far the current frame is between the last two ticks.
+    modes = ('capped', 'busy', 'vsync', 'uncapped', 'offline')
+
+    def __init__(self, fps=FPS, mode=PACING, tick_rate=TICK_RATE):
+        if mode not in self.modes:
+            raise ValueError(f"unknown pacing mode {mode!r}")
+        self.fps = fps
+        self.mode = mode
+        self.tick_time = 1 / tick_rate
+        self.accumulator = 0
+        self.alpha = 0
+        self.last = time.perf_counter()
+
+    def reset(self):
+        """Start counting frame time from now, e.g. when a level starts."""
+        self.accumulator = 0
+        self.alpha = 0
+        self.last = time.perf_counter()
+        clock.tick()
+
+    def wait(self, inputs=None):
+        """Wait for the next frame and return the seconds since the last one.
+
+        If inputs is given, events that come in while waiting are collected into it as they arrive, so
+        their timestamps are not rounded up to the next frame.
+        """
+        if self.mode == 'capped':
+            if inputs is not None and self.fps > 0:
+                inputs.collect(self.last + 1 / self.fps)
+            clock.tick(self.fps)
+        elif self.mode == 'busy':
+            if inputs is not None and self.fps > 0:
+                inputs.collect(self.last + 1 / self.fps, busy=True)
+            clock.tick_busy_loop(self.fps)
+        elif self.mode == 'offline':
+            clock.tick()
+            self.last = time.perf_counter()
+            return self.tick_time
+        else:
+            clock.tick()
+        # clock.tick counts whole milliseconds, which would make 60 FPS alternate between one and two
+        #   ticks a frame
+        now = time.perf_counter()
+        seconds = now - self.last
+        self.last = now
+        return seconds
+
+    def advance(self, seconds):
+        """Add a frame's time and return how many ticks are due."""
+        self.accumulator += min(seconds, MAX_FRAME_TIME)
+        ticks = int(self.accumulator / self.tick_time)
+        self.accumulator -= ticks * self.tick_time
+        self.alpha = self.accumulator / self.tick_time
+        return ticks
+
+    def next_mode(self):
+        """Switch to the next mode that does not need a new window and is meant for playing."""
+        switchable = [mode for mode in self.modes if mode not in ('vsync', 'offline')]
+        if self.mode in switchable:
+            self.mode = switchable[(switchable.index(self.mode) + 1) % len(switchable)]
+        else:
+            self.mode = switchable[0]
+
+    def next_fps(self, choices=(30, 60, 120, 144, 240)):
+        """Switch to the next frame rate in choices."""
+        later = [fps for fps in choices if fps > self.fps]
+        self.fps = later[0] if later else choices[0]
+
+
+pacer = FramePacer()
+
+
+class InputLayer:
+    # Collects events with the time they were seen, and hands space presses and releases to the
+    #   player at the tick they happened in rather than at the start of whichever frame drains them.
+    # Edges are applied one per tick, so a press and release that both land in the same tick still
+    #   give the player a tick to jump.
+    # It also measures input latency: the time from a space press to the end of the first frame drawn
+    #   after the jump it caused. Only presses that jump on the tick they are applied are measured, since
+    #   a press while in the air waits for the landing on purpose.
+    def __init__(self, samples=600):
+        self.edges = deque()
+        self.events = []
+        self.pressed_at = None
+        self.jumped_at = []
+        self.latency = deque(maxlen=samples)
+
+    def reset(self):
+        """Forget pending input, e.g. when a level starts."""
+        self.edges.clear()
+        self.pressed_at = None
+        self.jumped_at.clear()
+
+    def collect(self, deadline=None, busy=False):
+        """Collect events until the perf_counter time deadline, or just the waiting ones if it is None.
+
+        Waiting sleeps in pygame.event.wait, so each event is stamped as soon as it arrives. With busy it
+        polls instead, like clock.tick_busy_loop.
+        """
+        while True:
+            remaining = 0 if deadline is None else deadline - time.perf_counter()
+            if remaining <= 0:
+                self._add(pygame.event.get())
+                return
+            if busy:
+                self._add(pygame.event.get())
+            else:
+                event = pygame.event.wait(max(int(remaining * 1000), 1))
+                if event.type != pygame.NOEVENT:
+                    self._add([event])
+
+    def _add(self, events):
+        now = time.perf_counter()
+        for event in events:
+            if event.type in (pygame.KEYDOWN, pygame.KEYUP) and event.key == pygame.K_SPACE:
+                self.edges.append((now, event.type == pygame.KEYDOWN))
+            else:
+                self.events.append(event)
+
+    def take_events(self):
+        """Return and clear the collected events other than space presses and releases."""
+        events = self.events
+        self.events = []
+        return events
+
+    def next_edge(self, tick_end):
+        """Return the input for the tick ending at tick_end, as Simulation.step takes it: the oldest
+        space edge seen before then, True for a press and False for a release, or None."""
+        if self.edges and self.edges[0][0] <= tick_end:
+            timestamp, pressed = self.edges.popleft()
+            self.pressed_at = timestamp if pressed else None
+            return pressed
+        return None
+
+    def after_tick(self, player):
+        # Player._check_if_jump clears player.jump when it jumps
+        if self.pressed_at is not None and not player.jump:
+            self.jumped_at.append(self.pressed_at)
+        self.pressed_at = None
+
+    def frame_shown(self):
+        """Record the latency of the jumps in the frame that was just put on the display."""
+        now = time.perf_counter()
+        for timestamp in self.jumped_at:
+            self.latency.append(now - timestamp)
+        self.jumped_at.clear()
+
+    def percentile(self, p):
+        """Return the pth percentile of the recent input latencies in seconds, or None without any."""
+        if not self.latency:
+            return None
+        ordered = sorted(self.latency)
+        return ordered[min(round(p / 100 * (len(ordered) - 1)), len(ordered) - 1)]
+
+
+inputs = InputLayer()
+
+
+class FrameProfiler:
+    # Times the phases of each frame of run(). mark(phase) ends a phase that started at the previous
+    #   mark, so the phases add up to the whole frame.
+    # The last `history` frames are kept for the F3 overlay. record() also writes every frame to a CSV
+    #   file, one row per frame with each phase in milliseconds and the frame's counts.
+    phases = ('wait', 'events', 'fill', 'physics', 'draw', 'overlay', 'display')
+    counts = ('ticks', 'tiles', 'blits')
+
+    def __init__(self, history=240):
+        self.frames = deque(maxlen=history)
+        self.times = dict.fromkeys(self.phases, 0)
+        self.start = self.last = time.perf_counter()
+        self.frame_count = 0
+        # (phase, seconds) for building the current level's World
+        self.world_times = []
+        self.csv_file = None
+        self.csv_writer = None
+
+    def start_frame(self):
+        self.times = dict.fromkeys(self.phases, 0)
+        self.start = self.last = time.perf_counter()
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.times[phase] += now - self.last
+        self.last = now
+
+    def end_frame(self, **counts):
+        self.frames.append((self.last - self.start, self.times, counts))
+        self.frame_count += 1
+        if self.csv_writer is not None:
+            self.csv_writer.writerow([self.frame_count, f"{(self.last - self.start) * 1000:.3f}"] +
+                                     [f"{self.times[phase] * 1000:.3f}" for phase in self.phases] +
+                                     [counts.get(count, '') for count in self.counts])
+
+    def average(self, phase=None, frames=60):
+        """Return the mean time of a phase, or of whole frames if phase is None, over recent frames."""
+        recent = list(self.frames)[-frames:]
+        if not recent:
+            return 0
+        if phase is None:
+            return sum(total for total, times, counts in recent) / len(recent)
+        return sum(times[phase] for total, times, counts in recent) / len(recent)
+
+    def record(self, filename):
+        """Write every frame from now on to a CSV file."""
+        self.close()
+        self.csv_file = open(filename, 'w', newline='')
+        self.csv_writer = csv.writer(self.csv_file)
+        self.csv_writer.writerow(['frame', 'frame_ms'] + [f"{phase}_ms" for phase in self.phases] +
+                                 list(self.counts))
+
+    def close(self):
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+            self.csv_writer = None
+
+    def draw(self, screen, x, y, target=None, scale=50):
+        """Draw the per-phase times as text at x, y and a frame time sparkline at the top right.
+
+        The sparkline is scale ms tall with a line at target, the frame time being aimed for, in ms.
+        """
+        for phase in self.phases:
+            draw_text(screen, f"{phase:<8}{self.average(phase) * 1000:6.2f} ms", x, y, size=20)
+            y += 16
+        if self.world_times:
+            total = sum(seconds for phase, seconds in self.world_times)
+            parts = ", ".join(f"{phase} {seconds * 1000:.1f}" for phase, seconds in self.world_times)
+            draw_text(screen, f"World built in {total * 1000:.1f} ms ({parts})", x, y, size=20)
+
+        width = self.frames.maxlen
+        height = 60
+        left = screen.get_width() - width - 10
+        pygame.draw.rect(screen, colors["Black"], (left, 10, width, height))
+        if target:
+            target_y = 10 + height - min(target / scale, 1) * height
+            pygame.draw.line(screen, colors["Green"], (left, target_y), (left + width - 1, target_y))
+        if len(self.frames) > 1:
+            points = [(left + i, 10 + height - min(total * 1000 / scale, 1) * (height - 1))
+                      for i, (total, times, counts) in enumerate(self.frames)]
+            pygame.draw.lines(screen, colors["Yellow"], False, points)
+
+
+profiler = FrameProfiler()
 
 
 def reverse(item: int or float or bool):
@@ -43,6 +413,8 @@ def reverse(item: int or float or bool):
     return item
 
 
+fonts = {}
+
 colors = {
     "Yellow": [255, 255, 0],
     "Red": [255, 0, 0],
@@ -79,28 +451,103 @@ class Image:
 class Button(Image):
     def __init__(self, screen, image, x, y):
         super().__init__(screen, image, x, y)
-        self.clicked = False
+        self.hovered = False
+        self.hover_image = image.copy()
+        self.hover_image.fill((40, 40, 40), special_flags=pygame.BLEND_RGB_ADD)
+        self.background = None
 
     def draw(self):
-        action = False
+        # Keep what is behind the button so it can be redrawn on its own when it is hovered
+        if self.background is None:
+            self.background = self.screen.subsurface(self.rect.clip(self.screen.get_rect())).copy()
+        else:
+            self.screen.blit(self.background, self.rect)
+        self.screen.blit(self.hover_image if self.hovered else self.image, self.rect)
+
+    def hover(self, pos):
+        """Update hovered for the mouse position and return whether it changed."""
+        hovered = bool(self.rect.collidepoint(pos))
+        changed = hovered != self.hovered
+        self.hovered = hovered
+        return changed
+
+
+def run_menu(screen, images: list, buttons: list):
+    """Show a menu until one of its buttons is clicked, and return that button, or None on quit.
+
+    The menu sleeps in pygame.event.wait instead of redrawing every frame. Only buttons whose hover
+    state changes are drawn again, and only their rects are updated on the display.
+    """
+    for item in images + buttons:
+        item.draw()
+    pygame.display.update()
 
-        pos = pygame.mouse.get_pos()
-        if self.rect.collidepoint(pos):
-            if pygame.mouse.get_pressed()[0] == 1 and self.clicked is False:
-                self.clicked = True
-                action = True
+    while True:
+        event = pygame.event.wait(MENU_TIMEOUT)
+        if event.type == pygame.QUIT:
+            return None
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            for button in buttons:
+                if button.rect.collidepoint(event.pos):
+                    return button
+        elif event.type == pygame.MOUSEMOTION:
+            dirty = []
+            for button in buttons:
+                if button.hover(event.pos):
+                    button.draw()
+                    dirty.append(button.rect)
+            if dirty:
+                pygame.display.update(dirty)
+        elif event.type == pygame.WINDOWEXPOSED:
+            pygame.display.update()
 
-        if pygame.mouse.get_pressed()[0] == 1:
-            self.clicked = False
 
-        self.screen.blit(self.image, self.rect)
+class Assets:
+    # Every image in data/img, loaded from disk once and converted to the display's pixel format so
+    #   blitting it needs no conversion. Images are looked up by file name, e.g. assets['title.png'].
+    # Images that have not been loaded yet are loaded when they are first asked for. warm() loads the
+    #   rest on a background thread, so later screens do not have to wait for the disk.
+    def __init__(self, directory='data/img'):
+        self.directory = directory
+        self.images = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, name: str):
+        image = self.images.get(name)
+        if image is None:
+            image = self.load(name)
+        return image
+
+    def load(self, name: str):
+        with self.lock:
+            if name not in self.images:
+                image = pygame.image.load(os.path.join(self.directory, name))
+                if image.get_flags() & pygame.SRCALPHA:
+                    image = image.convert_alpha()
+                else:
+                    image = image.convert()
+                self.images[name] = image
+            return self.images[name]
+
+    def load_all(self):
+        for name in sorted(os.listdir(self.directory)):
+            self.load(name)
 
-        return action
+    def warm(self):
+        """Start loading every image in the background. The display has to be set up first."""
+        thread = threading.Thread(target=self.load_all, daemon=True)
+        thread.start()
+        return thread
 
 
+assets = Assets()
+
 """World"""
 
 
+WorldState = namedtuple('WorldState', ['player', 'spent_portals'])
+
+
 class World:
     # Tile types:
     # -1: Blank space
@@ -112,88 +559,304 @@ class World:
     # 7: End portal
     # 8: Backwards portal
     # 9: Gravity portal
-    # These tiles are stored in three separate sprite groups: self.players, self.obstacles, self.platforms
-    #   which in turn are stored in a list.
-    def __init__(self, screen, tile_size, data: list):
+    # Every tile is bucketed by its grid cell in self.collisions so the player only has to check the
+    #   cells it overlaps.
+    # Blocks and obstacles never change, so they are drawn through self.renderer's pre-rendered chunks.
+    #   Only the player and the portals near the screen are drawn tile by tile.
+    # screen may be None to build a world that is only simulated, never drawn. The player dies once it
+    #   falls past bottom, the bottom of the screen by default. Without a screen pass screen_height() of
+    #   the whole pack as bottom to die where the game would; it is the level's own height otherwise.
+    # data is either a list of rows of tiles or a SparseLevel. Lists are turned into a SparseLevel
+    #   first, so only the tiles that are there get visited.
+    def __init__(self, screen, tile_size, data, bottom=None):
+        # How long each step of building the world took, for the profiler
+        start = time.perf_counter()
+        if not isinstance(data, SparseLevel):
+            data = SparseLevel.from_rows(data)
+        parsed = time.perf_counter()
         self.data = data
         if not self._check_data():
             raise IndexError
         self.screen = screen
         self.tile_size = tile_size
+        if bottom is not None:
+            self.bottom = bottom
+        elif screen is None:
+            self.bottom = max(SCREEN_HEIGHT, data.height * tile_size)
+        else:
+            self.bottom = screen.get_height()
 
-        for y, row in enumerate(data):
-            for x, tile in enumerate(row):
-                if tile == 0:
-                    player = Player(self.screen, x * self.tile_size, y * self.tile_size,
-                                    self.tile_size * 0.75, self.tile_size * 0.75, "Dark Blue", "Gray", self)
-                    self.player = player
-
-        # Sprite Groups
-        self.blocks = pygame.sprite.Group()
-        self.obstacles = pygame.sprite.Group()
-        self.special_tiles = pygame.sprite.Group()
+        self.collisions = CollisionIndex(self.tile_size)
+        self.renderer = LevelRenderer(self.screen, self.tile_size, data.width, data.height)
 
         block = None
         obstacle = None
         special_tile = None
-        for y, row in enumerate(data):
-            for x, tile in enumerate(row):
-                # Regular block
-                if 1 <= tile <= 3:
-                    if tile == 1:
-                        block = Block(self.screen, x * self.tile_size, y * self.tile_size,
-                                      self.tile_size, self.tile_size, "Gray")
-                    elif tile == 2:
-                        block = Block(self.screen, x * self.tile_size, y * self.tile_size,
-                                      self.tile_size, self.tile_size, "White")
-                    elif tile == 3:
-                        block = Block(self.screen, x * self.tile_size, y * self.tile_size,
-                                      self.tile_size, self.tile_size, "Black")
-                    self.blocks.add(block)
-                # Obstacle and lava
-                elif 4 <= tile <= 6:
-                    if tile == 4:
-                        obstacle = Spike(self.screen, x * self.tile_size, y * self.tile_size,
-                                         self.tile_size, self.tile_size, "White")
-                    elif tile == 5:
-                        obstacle = Lava(self.screen, x * self.tile_size, y * self.tile_size + 4,
-                                        self.tile_size, self.tile_size - 4, "Red")
-                    elif tile == 6:
-                        obstacle = Spike(self.screen, x * self.tile_size, y * self.tile_size,
-                                         self.tile_size, self.tile_size, "White", 'd')
-                    self.obstacles.add(obstacle)
-                # Special circles
-                elif 7 <= tile <= 10:
-                    if tile == 7:
-                        special_tile = Portal(self.screen, x * tile_size, y * tile_size,
-                                              self.tile_size, self.tile_size, "Green", 'f')
-                    elif tile == 8:
-                        special_tile = Portal(self.screen, x * tile_size, y * tile_size,
-                                              self.tile_size, self.tile_size, "Pink", 'd')
-                    elif tile == 9:
-                        special_tile = Portal(self.screen, x * tile_size, y * tile_size,
-                                              self.tile_size, self.tile_size, "Dark Blue", 'g')
-                    elif tile == 10:
-                        special_tile = Portal(self.screen, x * tile_size, y * tile_size,
-                                              self.tile_size, self.tile_size, "Yellow", 'j')
-                    self.special_tiles.add(special_tile)
-
-        self.sprite_groups = [self.player, self.blocks, self.obstacles, self.special_tiles]
+        for x, y, tile in data.tiles():
+            if tile == 0:
+                player = Player(self.screen, x * self.tile_size, y * self.tile_size,
+                                self.tile_size * 0.75, self.tile_size * 0.75, "Dark Blue", "Gray", self)
+                self.player = player
+            # Regular block
+            elif 1 <= tile <= 3:
+                if tile == 1:
+                    block = Block(self.screen, x * self.tile_size, y * self.tile_size,
+                                  self.tile_size, self.tile_size, "Gray")
+                elif tile == 2:
+                    block = Block(self.screen, x * self.tile_size, y * self.tile_size,
+                                  self.tile_size, self.tile_size, "White")
+                elif tile == 3:
+                    block = Block(self.screen, x * self.tile_size, y * self.tile_size,
+                                  self.tile_size, self.tile_size, "Black")
+                self.collisions.add(block, 0, x, y)
+                self.renderer.add(block, x)
+            # Obstacle and lava
+            elif 4 <= tile <= 6:
+                if tile == 4:
+                    obstacle = Spike(self.screen, x * self.tile_size, y * self.tile_size,
+                                     self.tile_size, self.tile_size, "White")
+                elif tile == 5:
+                    obstacle = Lava(self.screen, x * self.tile_size, y * self.tile_size + 4,
+                                    self.tile_size, self.tile_size - 4, "Red")
+                elif tile == 6:
+                    obstacle = Spike(self.screen, x * self.tile_size, y * self.tile_size,
+                                     self.tile_size, self.tile_size, "White", 'd')
+                self.collisions.add(obstacle, 1, x, y)
+                self.renderer.add(obstacle, x, 1)
+            # Special circles
+            elif 7 <= tile <= 10:
+                if tile == 7:
+                    special_tile = Portal(self.screen, x * tile_size, y * tile_size,
+                                          self.tile_size, self.tile_size, "Green", 'f')
+                elif tile == 8:
+                    special_tile = Portal(self.screen, x * tile_size, y * tile_size,
+                                          self.tile_size, self.tile_size, "Pink", 'd')
+                elif tile == 9:
+                    special_tile = Portal(self.screen, x * tile_size, y * tile_size,
+                                          self.tile_size, self.tile_size, "Dark Blue", 'g')
+                elif tile == 10:
+                    special_tile = Portal(self.screen, x * tile_size, y * tile_size,
+                                          self.tile_size, self.tile_size, "Yellow", 'j')
+                self.collisions.add(special_tile, 2, x, y)
+                self.renderer.add_dynamic(special_tile, x)
+
+        # Set to a Ghosts to race recorded runs
+        self.ghosts = None
+        built = time.perf_counter()
+
+        # Keep the player where it spawned on screen while the camera scrolls through the level
+        self.camera = Camera(self.player.rect.x)
+
+        # Retrying the level restores this instead of building the world again
+        self.initial_state = self.snapshot()
+        self.build_times = [('parse', parsed - start), ('tiles', built - parsed),
+                            ('state', time.perf_counter() - built)]
+
+    def snapshot(self):
+        """Return the state that changes while the level is played."""
+        return WorldState(self.player.snapshot(), frozenset(self.collisions.spent_portals))
+
+    def restore(self, state):
+        self.player.restore(state.player)
+        for portal in self.collisions.spent_portals:
+            portal.on = True
+        self.collisions.spent_portals = set(state.spent_portals)
+        for portal in self.collisions.spent_portals:
+            portal.on = False
+        self.camera.follow(self.player)
+
+    def reset(self):
+        """Put the level back the way it was when it was built."""
+        self.restore(self.initial_state)
+
+    def draw(self, position=None, tick=0, alpha=0):
+        """Draw the level. position is where to draw the player instead of its rect, see
+        Simulation.interpolate. Ghosts are drawn alpha of the way from tick - 1 to tick."""
+        if self.ghosts is not None:
+            self.ghosts.draw(self.camera, tick, alpha)
+        self.player.draw(self.camera, position)
+        self.renderer.draw(self.camera)
 
     def _check_data(self):
         """Check if data can be processed."""
-        length = 0
-        start = False
-        for y in self.data:
-            n_length = len(y)
-            if start:
-                if n_length == length:
-                    length = n_length
-                else:
-                    return False
-            else:
-                length = n_length
-        return True
+        # Every row has to be the same length
+        return self.data.width is not None
+
+
+class CollisionIndex:
+    # Tiles are bucketed by the grid cell they were built in. Every tile's rect lies inside its own cell,
+    #   so the tiles that can overlap a rect are exactly the ones in the cells the rect covers.
+    # Buckets hold (group, order, sprite) where group is 0 for blocks, 1 for obstacles and 2 for
+    #   special tiles, the order Player.update checks them in.
+    def __init__(self, tile_size):
+        self.tile_size = tile_size
+        self.cells = {}
+        self.count = 0
+        self.spent_portals = set()
+
+    def add(self, sprite, group: int, x: int, y: int):
+        self.cells.setdefault((x, y), []).append((group, self.count, sprite))
+        self.count += 1
+
+    def query(self, rect):
+        """Return (group, sprite) pairs that may overlap rect, in the order the level was built."""
+        left = rect.left // self.tile_size
+        right = (rect.right - 1) // self.tile_size
+        top = rect.top // self.tile_size
+        bottom = (rect.bottom - 1) // self.tile_size
+
+        found = []
+        for y in range(top, bottom + 1):
+            for x in range(left, right + 1):
+                found.extend(self.cells.get((x, y), ()))
+        found.sort()
+        return [(group, sprite) for group, order, sprite in found]
+
+    def rearm_portals(self, touched):
+        """Turn back on every used portal that is no longer being touched."""
+        for portal in self.spent_portals - touched:
+            portal.on = True
+        self.spent_portals &= touched
+
+
+def sweep(rect, moved, target):
+    """Return when rect first touches target on its way to moved, from 0 to 1, or None if it does not.
+
+    rect moves in a straight line to moved. As with colliderect, touching edges do not count, and a target
+    that rect overlaps at the start but has moved off by the end is not counted.
+    """
+    entry = -math.inf
+    leave = math.inf
+    for low, high, target_low, target_high, move in (
+            (rect.left, rect.right, target.left, target.right, moved.x - rect.x),
+            (rect.top, rect.bottom, target.top, target.bottom, moved.y - rect.y)):
+        if move == 0:
+            if not (low < target_high and target_low < high):
+                return None
+            continue
+        # Along this axis the two overlap between these times
+        a = (target_low - high) / move
+        b = (target_high - low) / move
+        entry = max(entry, min(a, b))
+        leave = min(leave, max(a, b))
+    if entry >= leave:
+        return None
+    if moved.colliderect(target):
+        return max(entry, 0)
+    # Passed right through it
+    if 0 <= entry < 1 and not rect.colliderect(target):
+        return entry
+    return None
+
+
+class Camera:
+    # Tiles and the player keep their world coordinates. The camera holds the offset between the world
+    #   and the screen, and is only applied when drawing.
+    def __init__(self, anchor_x=0):
+        self.x = 0
+        self.y = 0
+        # Screen x the followed player is kept at
+        self.anchor_x = anchor_x
+
+    def apply(self, rect):
+        """Return rect moved from world to screen coordinates."""
+        return rect.move(-self.x, -self.y)
+
+    def follow(self, player):
+        self.x = player.rect.x - self.anchor_x
+
+    def follow_x(self, x):
+        """Follow a player drawn at world x, which may lie between two ticks."""
+        self.x = round(x) - self.anchor_x
+
+
+class LevelRenderer:
+    # Draws the static tiles of a level into surfaces chunk_tiles columns wide, so a frame is a few
+    #   blits instead of one pygame.draw call per tile.
+    # Chunks are rendered the first time they come into view and the least recently used ones are
+    #   dropped once more than max_chunks are kept, so memory does not grow with the level length.
+    # Tiles that change while playing (portals) are drawn every frame, but only if they are within
+    #   margin pixels of the screen. self.skipped counts the tiles left out of the last frame.
+    background = (255, 0, 255)
+
+    def __init__(self, screen, tile_size, width: int, height: int, chunk_tiles=8, max_chunks=8, margin=None):
+        self.screen = screen
+        self.margin = tile_size if margin is None else margin
+        self.chunk_width = chunk_tiles * tile_size
+        # Spikes on the bottom row draw one pixel past the last row
+        self.chunk_height = height * tile_size + 1
+        self.chunk_tiles = chunk_tiles
+        self.chunk_count = (width + chunk_tiles - 1) // chunk_tiles
+        self.max_chunks = max_chunks
+        # Blocks are drawn below obstacles, as with the sprite groups
+        self.layers = [[[] for _ in range(self.chunk_count)] for _ in range(2)]
+        self.dynamic = [[] for _ in range(self.chunk_count)]
+        self.chunks = OrderedDict()
+        self.tile_count = 0
+        self.skipped = 0
+        self.blits = 0
+
+    def add(self, sprite, x: int, layer=0):
+        self.layers[layer][x // self.chunk_tiles].append(sprite)
+        self.tile_count += 1
+
+    def add_dynamic(self, sprite, x: int):
+        self.dynamic[x // self.chunk_tiles].append(sprite)
+        self.tile_count += 1
+
+    def prerender(self, first=0, last=None):
+        """Render the chunks from first to last up front."""
+        if last is None:
+            last = min(first + self.max_chunks, self.chunk_count) - 1
+        for index in range(first, last + 1):
+            self._get_chunk(index)
+
+    def draw(self, camera):
+        left = camera.x - self.margin
+        right = camera.x + self.screen.get_width() + self.margin
+        first = max(left // self.chunk_width, 0)
+        last = min((right - 1) // self.chunk_width, self.chunk_count - 1)
+
+        drawn = 0
+        blits = 0
+        for index in range(first, last + 1):
+            self.screen.blit(self._get_chunk(index), (index * self.chunk_width - camera.x, -camera.y))
+            drawn += len(self.layers[0][index]) + len(self.layers[1][index])
+            blits += 1
+        for index in range(first, last + 1):
+            for sprite in self.dynamic[index]:
+                if sprite.rect.right > left and sprite.rect.left < right:
+                    sprite.draw(camera)
+                    drawn += 1
+                    blits += 1
+        self.skipped = self.tile_count - drawn
+        self.blits = blits
+
+    def _get_chunk(self, index: int):
+        chunk = self.chunks.get(index)
+        if chunk is None:
+            chunk = self._render_chunk(index)
+            self.chunks[index] = chunk
+            if len(self.chunks) > self.max_chunks:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end(index)
+        return chunk
+
+    def _render_chunk(self, index: int):
+        chunk = pygame.Surface((self.chunk_width, self.chunk_height), 0, self.screen)
+        chunk.fill(self.background)
+        chunk_camera = Camera()
+        chunk_camera.x = index * self.chunk_width
+        for layer in self.layers:
+            for sprite in layer[index]:
+                sprite.draw(chunk_camera, chunk)
+        chunk.set_colorkey(self.background, pygame.RLEACCEL)
+        return chunk
+
+
+PlayerState = namedtuple('PlayerState', ['x', 'y', 'vel_y', 'speed', 'jump_height', 'gravity', 'in_air', 'jump',
+                                         'portal_jump', 'result'])
 
 
 class Player(pygame.sprite.Sprite):
@@ -225,10 +888,26 @@ class Player(pygame.sprite.Sprite):
         self.jump_height = 11
         self.gravity = 0.75
         self.result = None
-
-    def draw(self):
-        self.screen.blit(self.image, self.rect)
-        self.screen.blit(self.inner_image, self.inner_image_rect)
+        self.max_step = MAX_STEP
+
+    def draw(self, camera, position=None):
+        rect = self.rect
+        inner_image_rect = self.inner_image_rect
+        if position is not None:
+            rect = self.rect.copy()
+            rect.topleft = round(position[0]), round(position[1])
+            inner_image_rect = rect.inflate(-4, -4)
+        self.screen.blit(self.image, camera.apply(rect))
+        self.screen.blit(self.inner_image, camera.apply(inner_image_rect))
+
+    def snapshot(self):
+        return PlayerState(self.rect.x, self.rect.y, self.vel_y, self.speed, self.jump_height, self.gravity,
+                           self.in_air, self.jump, self.portal_jump, self.result)
+
+    def restore(self, state):
+        (self.rect.x, self.rect.y, self.vel_y, self.speed, self.jump_height, self.gravity,
+         self.in_air, self.jump, self.portal_jump, self.result) = state
+        self._position_inner_image()
 
     def _position_inner_image(self):
         self.inner_image_rect.width = self.rect.width - 4
@@ -238,54 +917,106 @@ class Player(pygame.sprite.Sprite):
 
     def update(self):
         if not pause:
-            global x_scroll
-            x_scroll = 0
-            dx = self.speed
-            dy = 0
-
             self._check_if_jump()
 
             self.vel_y += self.gravity
-            dy += self.vel_y
 
-            # Check for collision
-            x_collision_rect = pygame.Rect(self.rect.x + dx, self.rect.y, self.rect.width, self.rect.height)
-            y_collision_rect = pygame.Rect(self.rect.x, self.rect.y + dy, self.rect.width, self.rect.height)
-            self.in_air = True
-            for g, sprites in enumerate(self.world.sprite_groups[1:]):
-                for sprite in sprites:
-                    if pygame.Rect.colliderect(x_collision_rect, sprite.rect):
-                        if g == 2:
-                            self.check_special_tile_attributes(sprite)
-                        else:
-                            self.die()
-                    elif pygame.Rect.colliderect(y_collision_rect, sprite.rect):
-                        if g == 1:
-                            self.die()
-                        elif g == 2:
-                            self.check_special_tile_attributes(sprite)
-                        else:
-                            if self._is_gravity_normal():
-                                if self.vel_y < 0:
-                                    dy = self._block_jump(sprite)
-                                elif self.vel_y >= 0:
-                                    dy = self._block_fall(sprite)
-                            else:
-                                if self.vel_y <= 0:
-                                    dy = self._block_reverse_fall(sprite)
-                                if self.vel_y > 0:
-                                    dy = self._block_reverse_jump(sprite)
-                    else:
-                        if g == 2:
-                            sprite.on = True
-
-            self.rect.y += dy
-            x_scroll = -dx
-            if self.rect.y >= SCREEN_HEIGHT or self.rect.bottom < -200:
+            steps = 1
+            if self.max_step:
+                steps = max(math.ceil(max(abs(self.speed), abs(self.vel_y)) / self.max_step), 1)
+            if steps == 1:
+                self._move(self.speed, self.vel_y)
+            else:
+                # Whole pixels at a time, since the rect would round away a fraction of one on every sub-step.
+                #   vel_y is read again each time, as landing or a jump pad changes it part way.
+                landed = False
+                for step in range(steps):
+                    self._move(round(self.speed * (step + 1) / steps) - round(self.speed * step / steps),
+                               round(self.vel_y * (step + 1) / steps) - round(self.vel_y * step / steps))
+                    landed = landed or not self.in_air
+                    if self.result is not None:
+                        break
+                self.in_air = not landed
+
+            if self.rect.y >= self.world.bottom or self.rect.bottom < -200:
                 self.die()
 
             self._position_inner_image()
 
+    def _move(self, dx, dy):
+        # Check for collision
+        x_collision_rect = pygame.Rect(self.rect.x + dx, self.rect.y, self.rect.width, self.rect.height)
+        y_collision_rect = pygame.Rect(self.rect.x, self.rect.y + dy, self.rect.width, self.rect.height)
+        self.in_air = True
+        touched_portals = set()
+        move_y = dy
+        candidates = self.world.collisions.query(x_collision_rect.union(y_collision_rect))
+        swept = None
+        if abs(dx) > self.rect.width or abs(dy) > self.rect.height:
+            swept = self._sweep(x_collision_rect, y_collision_rect, candidates)
+        for g, sprite in candidates:
+            if swept is not None:
+                x_hit, y_hit = swept[sprite]
+            else:
+                # Too short a move to pass through anything, so only where the player ends up matters
+                x_hit = x_collision_rect.colliderect(sprite.rect)
+                y_hit = not x_hit and y_collision_rect.colliderect(sprite.rect)
+            if x_hit:
+                if g == 2:
+                    touched_portals.add(sprite)
+                    self.check_special_tile_attributes(sprite)
+                else:
+                    self.die()
+            elif y_hit:
+                if g == 1:
+                    self.die()
+                elif g == 2:
+                    touched_portals.add(sprite)
+                    self.check_special_tile_attributes(sprite)
+                elif swept is not None:
+                    dy = self._block_contact(sprite, move_y)
+                else:
+                    if self._is_gravity_normal():
+                        if self.vel_y < 0:
+                            dy = self._block_jump(sprite)
+                        elif self.vel_y >= 0:
+                            dy = self._block_fall(sprite)
+                    else:
+                        if self.vel_y <= 0:
+                            dy = self._block_reverse_fall(sprite)
+                        if self.vel_y > 0:
+                            dy = self._block_reverse_jump(sprite)
+        # Portals switch back on as soon as the player stops touching them
+        self.world.collisions.rearm_portals(touched_portals)
+
+        self.rect.x += dx
+        self.rect.y += dy
+
+    def _sweep(self, x_collision_rect, y_collision_rect, candidates):
+        """Return {sprite: (x_hit, y_hit)} for a move fast enough to pass right through a tile in one tick.
+
+        Each axis is swept on its own, and stops at the first block in its way without reaching anything
+        behind it.
+        """
+        x_times = [sweep(self.rect, x_collision_rect, sprite.rect) for g, sprite in candidates]
+        y_times = [sweep(self.rect, y_collision_rect, sprite.rect) for g, sprite in candidates]
+        x_stop = min((hit_time for (g, sprite), hit_time in zip(candidates, x_times)
+                      if g == 0 and hit_time is not None), default=1)
+        y_stop = min((hit_time for (g, sprite), hit_time in zip(candidates, y_times)
+                      if g == 0 and hit_time is not None), default=1)
+        return {sprite: (x_time is not None and x_time <= x_stop, y_time is not None and y_time <= y_stop)
+                for (g, sprite), x_time, y_time in zip(candidates, x_times, y_times)}
+
+    def _block_contact(self, sprite, move_y):
+        # The block helpers below assume the block is next to the player, so a swept move stops where it
+        #   first touches the block instead, and lands if it was moving with gravity
+        self.vel_y = 0
+        if move_y < 0:
+            self.in_air = self._is_gravity_normal()
+            return sprite.rect.bottom - self.rect.top
+        self.in_air = not self._is_gravity_normal()
+        return sprite.rect.top - self.rect.bottom
+
     def die(self):
         self.result = False
 
@@ -308,6 +1039,7 @@ class Player(pygame.sprite.Sprite):
                 self.portal_jump = True
                 self._check_if_jump()
             sprite.on = False
+            self.world.collisions.spent_portals.add(sprite)
 
     def _block_fall(self, sprite):
         self.vel_y = 0
@@ -362,11 +1094,10 @@ class Block(pygame.sprite.Sprite):
         self.rect.x = x
         self.rect.y = y
 
-    def update(self):
-        self.rect.x += x_scroll
-
-    def draw(self):
-        pygame.draw.rect(self.screen, colors[self.color], self.rect)
+    def draw(self, camera, surface=None):
+        if surface is None:
+            surface = self.screen
+        pygame.draw.rect(surface, colors[self.color], camera.apply(self.rect))
 
 
 class Spike(Block):
@@ -380,17 +1111,17 @@ class Spike(Block):
         elif self.orientation == 'd':
             self.rect = pygame.Rect(width / 4 + x, y, width / 2, height / 2)
 
-    def update(self):
-        self.rect.x += x_scroll
-
-    def draw(self):
+    def draw(self, camera, surface=None):
+        if surface is None:
+            surface = self.screen
+        rect = camera.apply(self.rect)
         if self.orientation == 'u':
-            pygame.draw.polygon(self.screen, colors[self.color],
-                                [self.rect.bottomleft, self.rect.midtop, self.rect.bottomright])
+            pygame.draw.polygon(surface, colors[self.color],
+                                [rect.bottomleft, rect.midtop, rect.bottomright])
         elif self.orientation == 'd':
-            pygame.draw.polygon(self.screen, colors[self.color],
-                                [self.rect.topleft, self.rect.midbottom,
-                                 self.rect.topright])
+            pygame.draw.polygon(surface, colors[self.color],
+                                [rect.topleft, rect.midbottom,
+                                 rect.topright])
 
 
 class Lava(Block):
@@ -407,46 +1138,254 @@ class Portal(pygame.sprite.Sprite):
 
         self.on = True
 
-    def update(self):
-        self.rect.x += x_scroll
+    def draw(self, camera):
+        pygame.draw.circle(self.screen, colors[self.color], camera.apply(self.rect).center, self.rect.width / 2)
 
-    def draw(self):
-        pygame.draw.circle(self.screen, colors[self.color], self.rect.center, self.rect.width / 2)
 
+"""Simulation"""
 
-"""Intro"""
 
+Outcome = namedtuple('Outcome', ['result', 'tick', 'x', 'y'])
+
+
+class Simulation:
+    # Advances a World one tick at a time with no drawing, no event queue and no clock, so levels can
+    #   be played back from an input stream as fast as the CPU allows, with or without a display.
+    # Inputs are given per tick: True when space was pressed, False when it was released and None when
+    #   nothing changed, the same way run() turns KEYDOWN and KEYUP events into player.jump.
+    # Every input that changes player.jump is recorded in self.edges as (tick, jump), which is all a
+    #   replay needs to play the run again (see replay.py).
+    def __init__(self, data: list, tile_size=TILE_SIZE, world=None, bottom=None):
+        if world is None:
+            world = World(None, tile_size, data, bottom)
+        self.world = world
+        self.player = world.player
+        self.tick = 0
+        self.edges = []
+        # Where the player was before the last tick, for drawing between ticks
+        self.previous = self.player.rect.topleft
+
+    def step(self, jump=None):
+        """Advance one tick and return player.result."""
+        if self.player.result is None:
+            if jump is not None and jump != self.player.jump:
+                self.player.jump = jump
+                self.edges.append((self.tick, jump))
+            self.previous = self.player.rect.topleft
+            self.player.update()
+            self.tick += 1
+        return self.player.result
+
+    def run(self, inputs, max_ticks=None):
+        """Step through inputs, then keep going without input, until the level ends or max_ticks."""
+        inputs = iter(inputs)
+        while self.player.result is None and (max_ticks is None or self.tick < max_ticks):
+            self.step(next(inputs, None))
+        return self.outcome()
+
+    def reset(self):
+        self.world.reset()
+        self.tick = 0
+        self.edges = []
+        self.previous = self.player.rect.topleft
+
+    def interpolate(self, alpha):
+        """Return the player's position alpha of the way from before the last tick to now."""
+        (x0, y0), (x1, y1) = self.previous, self.player.rect.topleft
+        return x0 + (x1 - x0) * alpha, y0 + (y1 - y0) * alpha
+
+    def outcome(self):
+        return Outcome(self.player.result, self.tick, self.player.rect.x, self.player.rect.y)
+
+
+def simulate(data: list, inputs, max_ticks=None, bottom=None):
+    """Play a level from inputs headlessly and return its Outcome. bottom is as for World."""
+    return Simulation(data, bottom=bottom).run(inputs, max_ticks)
+
+
+class LevelPipeline:
+    # Prepares levels on a background thread, so starting one does not freeze the screen.
+    # Preparing a level reads its tiles, builds its World (sprites and collision index) and pre-renders
+    #   the chunks it starts on. The next level is prepared while the current one is played, so reaching
+    #   an end portal hands straight over to a World that is ready.
+    # Errors from preparing a level, such as the IndexError past the last level, are raised from take().
+    def __init__(self, data):
+        self.data = data
+        # Level number: (thread, job), where the thread puts 'simulation' or 'error' in the job dict
+        self.prepared = {}
+
+    def prefetch(self, screen, level: int):
+        """Start preparing a level in the background, unless it is already being prepared."""
+        if level in self.prepared:
+            return
+        job = {}
+        thread = threading.Thread(target=self._prefetch, args=(screen, level, job), daemon=True)
+        self.prepared[level] = (thread, job)
+        thread.start()
+
+    def _prefetch(self, screen, level: int, job: dict):
+        try:
+            job['simulation'] = self.prepare(screen, level)
+        except Exception as error:
+            job['error'] = error
+
+    def prepare(self, screen, level: int):
+        """Build a level's Simulation now."""
+        # data[-1] would quietly give the last level
+        if level < 1:
+            raise IndexError(level)
+        # Packs and archives can give the level straight as a SparseLevel, which archives also cache
+        if isinstance(self.data, (LevelPack, LevelArchive)):
+            level_data = self.data.sparse(level - 1)
+        else:
+            level_data = self.data[level - 1]
+        world = World(screen, TILE_SIZE, level_data)
+        if screen is not None:
+            world.renderer.prerender()
+            if ghost_dir is not None:
+                world.ghosts = load_ghosts(screen, level, world)
+        return Simulation(level_data, world=world)
+
+    def take(self, screen, level: int):
+        """Return a level's Simulation, waiting for it if it is still being prepared, or preparing it
+        now if it was never prefetched. The Simulation is handed over and not kept."""
+        if level not in self.prepared:
+            return self.prepare(screen, level)
+        thread, job = self.prepared.pop(level)
+        thread.join()
+        if 'error' in job:
+            raise job['error']
+        return job['simulation']
+
+
+"""Ghosts"""
+
+
+class Ghosts:
+    # Recorded runs drawn as see-through cubes racing the player.
+    # A ghost's path is worked out once, by playing its replay through a headless Simulation, and kept
+    #   as its x and y after every tick. Showing it then costs a lookup per frame instead of a
+    #   Player.update per tick.
+    # Every ghost is the same surface with its transparency set once, and all ghosts on screen are
+    #   drawn with a single Surface.blits call.
+    def __init__(self, screen, size, color="Dark Blue", inner_color="Gray", alpha=90):
+        self.screen = screen
+        self.image = pygame.Surface((size, size), 0, screen)
+        self.image.fill(colors[color])
+        self.image.fill(colors[inner_color], (2, 2, size - 4, size - 4))
+        self.image.set_alpha(alpha, pygame.RLEACCEL)
+        self.size = size
+        # (xs, ys): position after each tick, starting with the spawn at index 0
+        self.paths = []
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add_path(self, xs, ys):
+        self.paths.append((xs, ys))
+
+    def add_replay(self, replay, simulation):
+        """Work out the path of a Replay through a Simulation of its level and add it as a ghost.
+
+        The Simulation is reset first, so one can be shared by every replay of the level.
+        """
+        simulation.reset()
+        player = simulation.player
+        xs = array('i', [player.rect.x])
+        ys = array('i', [player.rect.y])
+        for jump in replay.inputs():
+            simulation.step(jump)
+            xs.append(player.rect.x)
+            ys.append(player.rect.y)
+            if player.result is not None:
+                break
+        self.add_path(xs, ys)
+
+    def draw(self, camera, tick: int, alpha=0):
+        """Draw every ghost that has not finished by tick and is on screen."""
+        left = camera.x - self.size
+        right = camera.x + self.screen.get_width()
+        blits = []
+        for xs, ys in self.paths:
+            if tick >= len(xs):
+                continue
+            previous = max(tick - 1, 0)
+            x = xs[previous] + (xs[tick] - xs[previous]) * alpha
+            if left < x < right:
+                y = ys[previous] + (ys[tick] - ys[previous]) * alpha
+                blits.append((self.image, (round(x) - camera.x, round(y) - camera.y)))
+        self.screen.blits(blits, doreturn=False)
+
+
+def replay_prefix(level: int):
+    """Return how the names of replay files of a level start, as save_replay names them."""
+    return f"level_{level}_"
+
+
+def load_ghosts(screen, level: int, world):
+    """Return Ghosts of the fastest GHOST_COUNT replays in ghost_dir of this level, as it is now.
+
+    Only files named as save_replay names them for this level are read, so a directory holding many
+    levels' replays costs little more than this level's.
+    """
+    # Imported here so the game only loads the replay format when racing ghosts
+    from replay import CHECKSUM_SIZE, Replay, level_checksum
+    checksum = level_checksum(world.data)[:CHECKSUM_SIZE]
+    prefix = replay_prefix(level)
+    replays = []
+    for name in sorted(os.listdir(ghost_dir)):
+        if not (name.startswith(prefix) and name.endswith('.gdr')):
+            continue
+        with open(os.path.join(ghost_dir, name), 'rb') as f:
+            try:
+                replay = Replay.decode(f.read())
+            except ValueError:
+                continue
+        if replay.level == level and replay.checksum == checksum:
+            replays.append(replay)
+    # Wins first, then the quickest
+    replays.sort(key=lambda replay: (replay.result is not True, replay.ticks))
+
+    ghosts = Ghosts(screen, world.player.rect.width)
+    # Building a World for every replay would cost more than playing them all
+    simulation = Simulation(world.data, bottom=world.bottom)
+    for replay in replays[:GHOST_COUNT]:
+        ghosts.add_replay(replay, simulation)
+    return ghosts
 
-def run_intro():
-    screen = setup_screen()
 
-    global main_menu
-    main_menu = True
+"""Intro"""
 
-    def intro_terminate(redo=False):
-        global main_menu
-        main_menu = False
-        pygame.quit()
-        return redo
 
+def run_intro(screen):
     screen_rect = screen.get_rect()
 
-    title_img = pygame.image.load('data/img/title.png')
+    title_img = assets['title.png']
     title = Image(screen, title_img, 0, 0)
     title.position_center(centerx=screen_rect.centerx)
     title.rect.y = 20
 
-    start_btn_img = pygame.image.load('data/img/start_btn.png')
+    start_btn_img = assets['start_btn.png']
     start_btn = Button(screen, start_btn_img, 0, 0)
     start_btn.position_center(screen_rect.centerx, screen_rect.centery)
 
-    instructions_btn_img = pygame.image.load('data/img/instructions_btn.png')
+    instructions_btn_img = assets['instructions_btn.png']
     instructions_btn = Button(screen, instructions_btn_img, 0, 0)
     instructions_btn.position_center(screen_rect.centerx)
     instructions_btn.rect.top = start_btn.rect.bottom + 20
 
-    instructions = """
-Welcome to Geometry Dash. 
+    screen.fill(colors["Blue"])
+    pipeline.prefetch(screen, START_LEVEL)
+    clicked = run_menu(screen, [title], [start_btn, instructions_btn])
+    if clicked is instructions_btn:
+        return run_instructions,
+    if clicked is start_btn:
+        return play_level, START_LEVEL
+    return None
+
+
+instructions = """
+Welcome to Geometry Dash.
 Press the space bar to jump.
 Avoid the spikes and the lava.
 Don't crash into the sides of blocks.
@@ -455,24 +1394,27 @@ Blue Circles change your gravity.
 Pink Circles change your direction.
 Jump while touching a Yellow Circle to jump again.
 Get to the last level for the gravity challenge.
-                        """
-
-    while main_menu:
-        screen.fill(colors["Blue"])
+"""
 
-        title.draw()
-        if instructions_btn.draw():
-            show_alert(instructions, "How To Play")
-            return intro_terminate(True)
-        if start_btn.draw():
-            return intro_terminate()
 
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                intro_terminate()
+def run_instructions(screen):
+    """Show how to play in the game window until a key or mouse button is pressed."""
+    screen.fill(colors["Blue"])
+    y = 40
+    draw_text(screen, "How To Play", 40, y, size=48)
+    y += 60
+    for line in instructions.strip().splitlines():
+        draw_text(screen, line, 40, y, size=28)
+        y += 32
+    draw_text(screen, "Press any key to go back", 40, y + 20, "Light Orange", 28)
+    pygame.display.update()
 
-        if main_menu:
-            pygame.display.update()
+    while True:
+        event = pygame.event.wait(MENU_TIMEOUT)
+        if event.type == pygame.QUIT:
+            return None
+        if event.type in (pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN):
+            return run_intro,
 
 
 """End"""
@@ -481,120 +1423,198 @@ Get to the last level for the gravity challenge.
 def run_end(screen):
     screen_rect = screen.get_rect()
 
-    play_again_btn_image = pygame.image.load('data/img/play_again_btn.png')
+    play_again_btn_image = assets['play_again_btn.png']
     play_again_btn = Button(screen, play_again_btn_image, 0, 0)
     play_again_btn.position_center(centerx=screen_rect.centerx)
     play_again_btn.rect.bottom = screen_rect.centery - 20
 
-    credits_image = pygame.image.load('data/img/credits.png')
+    credits_image = assets['credits.png']
     credits = Image(screen, credits_image, 0, 0)
     credits.position_center(centerx=screen_rect.centerx)
     credits.rect.top = screen_rect.centery + 20
 
-    while True:
-
-        credits.draw()
-        if play_again_btn.draw():
-            game()
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                terminate()
-
-        pygame.display.update()
+    pipeline.prefetch(screen, START_LEVEL)
+    if run_menu(screen, [credits], [play_again_btn]) is play_again_btn:
+        return play_level, START_LEVEL
+    return None
 
 
 """Game"""
 
 
-def set_level(screen, level: int, data: list):
-    level_data = data[level - 1]
-    world = World(screen, TILE_SIZE, level_data)
-    while world.player.result is None:
-        run(screen, world.sprite_groups, world.player)
-    return world.player.result
-
-
-def run(screen, sprite_groups, player):
-    """Run the game."""
+def set_level(screen, simulation):
+    """Play a level once, until the player dies or wins, and return player.result."""
+    profiler.world_times = simulation.world.build_times
+    pacer.reset()
+    inputs.reset()
+    while simulation.player.result is None:
+        run(screen, simulation)
+    return simulation.player.result
 
-    def update_sprites():
-        for sprite_group in sprite_groups:
-            try:
-                for sprite in sprite_group:
-                    sprite.draw()
-            except TypeError:
-                # sprite_group is player, so call player's draw method
-                sprite_group.draw()
-            sprite_group.update()
 
-    clock.tick(FPS)
+def run(screen, simulation):
+    """Run one frame of the game.
 
-    screen.fill(colors["Blue"])
+    The physics is stepped at TICK_RATE however often frames are drawn, and the player is drawn
+    between its last two positions so motion stays smooth when the two rates differ.
+    """
+    global show_debug
+    world = simulation.world
+    camera = world.camera
+    player = simulation.player
 
-    # Check events
-    for event in pygame.event.get():
+    def update_sprites():
+        # Only the player moves; the camera follows it through the level
+        ticks = pacer.advance(frame_time)
+        # When the first tick due this frame ends in wall time. The simulation runs behind the clock by
+        #   what is left in the accumulator.
+        tick_end = pacer.last - pacer.accumulator - (ticks - 1) * pacer.tick_time
+        ticks_run = 0
+        for tick in range(ticks):
+            simulation.step(inputs.next_edge(tick_end + tick * pacer.tick_time))
+            inputs.after_tick(player)
+            ticks_run += 1
+            if player.result is not None:
+                break
+        profiler.mark('physics')
+        position = simulation.interpolate(pacer.alpha)
+        camera.follow_x(position[0])
+        world.draw(position, simulation.tick, pacer.alpha)
+        profiler.mark('draw')
+        return ticks_run
+
+    profiler.start_frame()
+    frame_time = pacer.wait(inputs)
+    profiler.mark('wait')
+    inputs.collect()
+
+    # Check events. Space is handled by inputs, tick by tick.
+    for event in inputs.take_events():
         if event.type == pygame.QUIT:
             terminate()
         elif event.type == pygame.KEYDOWN:
             if event.key == pygame.K_q:
                 terminate()
-            if event.key == pygame.K_SPACE:
-                player.jump = True
-        elif event.type == pygame.KEYUP:
-            if event.key == pygame.K_SPACE:
-                player.jump = False
+            if event.key == pygame.K_F3:
+                show_debug = not show_debug
+            if event.key == pygame.K_F4:
+                pacer.next_mode()
+            if event.key == pygame.K_F5:
+                pacer.next_fps()
+    profiler.mark('events')
+
+    screen.fill(colors["Blue"])
+    profiler.mark('fill')
 
     # Update sprites
-    update_sprites()
+    ticks = update_sprites()
+    if show_debug:
+        draw_debug(screen, world)
+    profiler.mark('overlay')
 
-    # Update screen
-    if not pause:
+    # Update screen. A frame drawn into an offscreen surface (see capture.py) has nothing to show.
+    if not pause and screen is pygame.display.get_surface():
         pygame.display.update()
-
-
-def game():
-    global level
-    level = START_LEVEL
-    screen = setup_screen()
+        inputs.frame_shown()
+    profiler.mark('display')
+    renderer = world.renderer
+    profiler.end_frame(ticks=ticks, tiles=renderer.tile_count - renderer.skipped, blits=renderer.blits)
+
+
+def draw_debug(screen, world):
+    """Draw the F3 overlay: frame rate, tile counts, input latency and the profiler's frame timings."""
+    renderer = world.renderer
+    draw_text(screen, f"FPS: {clock.get_fps():.0f} ({pacer.mode}, {pacer.fps}), "
+                      f"frame {profiler.average() * 1000:.2f} ms", 10, 10)
+    draw_text(screen, f"Tiles drawn: {renderer.tile_count - renderer.skipped}/{renderer.tile_count}, "
+                      f"blits: {renderer.blits}", 10, 30)
+    if inputs.latency:
+        draw_text(screen, f"Input latency: p50 {inputs.percentile(50) * 1000:.1f} ms, "
+                          f"p99 {inputs.percentile(99) * 1000:.1f} ms", 10, 50)
+    profiler.draw(screen, 10, 75, 1000 / pacer.fps if pacer.fps else None)
+
+
+def play_level(screen, level: int):
     try:
-        while True:
-            if set_level(screen, level, data):
-                level += 1
+        simulation = pipeline.take(screen, level)
     except IndexError:
-        run_end(screen)
+        # There are no more levels
+        return run_end,
+    # Get the next level ready while this one is played
+    pipeline.prefetch(screen, level + 1)
+    while not set_level(screen, simulation):
+        # Retrying the same level resets its simulation rather than building it again
+        simulation.reset()
+    if replay_dir is not None:
+        save_replay(simulation, level)
+    return play_level, level + 1
+
+
+def save_replay(simulation, level: int):
+    # Imported here so the game only loads the replay format when recording
+    from replay import Replay
+    os.makedirs(replay_dir, exist_ok=True)
+    filename = os.path.join(replay_dir, f"{replay_prefix(level)}{time.strftime('%Y%m%d_%H%M%S')}.gdr")
+    with open(filename, 'wb') as f:
+        f.write(Replay.from_simulation(simulation, level).encode())
+
+
+"""Scenes"""
+
+
+def run_scenes(screen, scene, *args):
+    """Run scenes one after another until one of them quits.
+
+    A scene is a function that takes the screen and its arguments, runs until it is finished and returns
+    the next scene and its arguments, or None to quit. Scenes never call each other, so the stack and
+    the old levels are let go of on every transition however long the game is played.
+    """
+    transition = (scene,) + args
+    while transition is not None:
+        scene, *args = transition
+        transition = scene(screen, *args)
+    terminate()
 
 
 if __name__ == '__main__':
-    # Set screen width
-    SCREEN_WIDTH = 600
-    # Set other settings
-    TILE_SIZE = 50
-
-    # Set game settings
-    x_scroll = 0
-    pause = False
-    stop = False
-    START_LEVEL = 1  # Leave at 1 except for testing
-    level = START_LEVEL
-
-    # Initialize clock
-    clock = pygame.time.Clock()
-    FPS = 60
-
-    data = get_data()
-    SCREEN_HEIGHT = 600
-    max_height = 0
-    for level_data in data:
-        height = len(level_data)
-        if height > max_height:
-            max_height = height
-    if max_height * TILE_SIZE > SCREEN_HEIGHT:
-        SCREEN_HEIGHT = max_height * TILE_SIZE
-
-    # Intro
-    redo = True
-    while redo:
-        redo = run_intro()
-    # Game
-    game()
+    parser = argparse.ArgumentParser(description="Play Geometry Dash.")
+    parser.add_argument('--data', default=None,
+                        help=f"level file, by default {LEVEL_FILE} or a level pack built from it since it changed")
+    parser.add_argument('--fps', type=int, default=FPS, help="frame rate for the capped and busy pacing modes")
+    parser.add_argument('--pacing', choices=[mode for mode in FramePacer.modes if mode != 'offline'],
+                        default=PACING, help="how frames are paced, F4 switches while playing")
+    parser.add_argument('--startup-report', action='store_true', help="print how long startup took")
+    parser.add_argument('--latency-report', action='store_true',
+                        help="print the time from pressing space to seeing the jump on quitting")
+    parser.add_argument('--profile-csv', metavar='FILE', help="write the timings of every frame to a CSV file")
+    parser.add_argument('--record', metavar='DIR', help="save a replay of every completed level in this directory")
+    parser.add_argument('--ghosts', metavar='DIR',
+                        help="race the fastest replays in this directory, named as --record names them")
+    args = parser.parse_args()
+    pacer = FramePacer(args.fps, args.pacing)
+    latency_report = args.latency_report
+    replay_dir = args.record
+    ghost_dir = args.ghosts
+    if args.profile_csv:
+        profiler.record(args.profile_csv)
+
+    startup = StartupReport(START_TIME)
+    startup.mark("imports")
+
+    data = get_data(args.data)
+    SCREEN_HEIGHT = screen_height(data)
+    startup.mark("levels")
+
+    screen = setup_screen()
+    pipeline = LevelPipeline(data)
+    startup.mark("init")
+
+    # The intro needs its images straight away. The rest are loaded while the intro is up.
+    for name in ('title.png', 'start_btn.png', 'instructions_btn.png'):
+        assets.load(name)
+    assets.warm()
+    startup.mark("assets")
+
+    if args.startup_report:
+        startup.print()
+    run_scenes(screen, run_intro)
@@ -0,0 +1,337 @@
+"""Level storage formats.
+
+Convert a JSON level file to a binary level pack with:
+    python levels.py data/level_data.json data/level_data.gdl
+or to a level archive, a zip file or a directory with one file per level, with:
+    python levels.py data/level_data.json data/levels.zip
+    python levels.py data/level_data.json data/levels
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from collections import OrderedDict
+from itertools import groupby
+
+BLANK = -1
+
+"""Sparse levels"""
+
+
+class SparseLevel:
+    # A level stored as runs of the same tile along each row, with blank space left out. Building a
+    #   World from it only touches the tiles that are there, so mostly empty levels are cheap to load.
+    # self.runs holds one list per row of (start column, length, tile) runs, in column order.
+    # self.width is None if the rows the level was made from were not all the same length.
+    def __init__(self, width, height: int, runs: list):
+        self.width = width
+        self.height = height
+        self.runs = runs
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a SparseLevel from a list of rows of tiles, as stored in level_data.json."""
+        width = len(rows[0]) if rows else 0
+        runs = []
+        for row in rows:
+            if len(row) != width:
+                width = None
+            row_runs = []
+            x = 0
+            for tile, group in groupby(row):
+                length = len(list(group))
+                if tile != BLANK:
+                    row_runs.append((x, length, tile))
+                x += length
+            runs.append(row_runs)
+        return cls(width, len(rows), runs)
+
+    def __len__(self):
+        return self.height
+
+    def tiles(self):
+        """Yield (x, y, tile) for every tile that is not blank, row by row."""
+        for y, row_runs in enumerate(self.runs):
+            for start, length, tile in row_runs:
+                for x in range(start, start + length):
+                    yield x, y, tile
+
+    def to_rows(self):
+        rows = [[BLANK] * self.width for _ in range(self.height)]
+        for x, y, tile in self.tiles():
+            rows[y][x] = tile
+        return rows
+
+
+def load_json(filename, sparse=True):
+    """Load a JSON level file, as SparseLevels unless sparse is False."""
+    with open(filename, 'r') as f:
+        levels = json.load(f)
+    if sparse:
+        levels = [SparseLevel.from_rows(level) for level in levels]
+    return levels
+
+
+"""Binary level packs"""
+
+# A pack starts with a header, then one table entry per level, then the tiles of every level, one
+#   signed byte per tile, row by row.
+# Header: magic, version, level count, height of the tallest level
+# Table entry: width, height, offset of the level's first tile from the start of the file
+MAGIC = b'GDLP'
+VERSION = 1
+HEADER = struct.Struct('<4sHII')
+ENTRY = struct.Struct('<IIQ')
+
+
+def write_pack(levels, filename):
+    """Write a list of levels (lists of rows of tiles) as a binary level pack."""
+    offset = HEADER.size + ENTRY.size * len(levels)
+    table = []
+    for level in levels:
+        height = len(level)
+        width = len(level[0]) if height else 0
+        if any(len(row) != width for row in level):
+            raise ValueError("every row of a level must be the same length")
+        table.append((width, height, offset))
+        offset += width * height
+
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(levels), max((height for _, height, _ in table), default=0)))
+        for entry in table:
+            f.write(ENTRY.pack(*entry))
+        for level in levels:
+            for row in level:
+                f.write(struct.pack(f'<{len(row)}b', *row))
+
+
+def convert(json_filename, pack_filename):
+    with open(json_filename, 'r') as f:
+        write_pack(json.load(f), pack_filename)
+
+
+class LevelPack:
+    # A binary level pack opened through mmap. Only the header and table are read up front; a level's
+    #   tiles are read from the mapping when that level is asked for.
+    # Indexing returns a level as a list of rows like the JSON loader does, so a pack can be used
+    #   anywhere the list of levels is. view() gives the tiles without copying them.
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, self.max_height = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{filename} is not a version {VERSION} level pack")
+        self.table = [ENTRY.unpack_from(self.map, HEADER.size + ENTRY.size * i) for i in range(count)]
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, index: int):
+        width, height, offset = self.table[index]
+        tiles = self.map[offset:offset + width * height]
+        return [list(struct.unpack_from(f'<{width}b', tiles, y * width)) for y in range(height)]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def sparse(self, index: int):
+        """Return a level as a SparseLevel."""
+        width, height, offset = self.table[index]
+        tiles = self.map[offset:offset + width * height]
+        return SparseLevel.from_rows([struct.unpack_from(f'<{width}b', tiles, y * width) for y in range(height)])
+
+    def size(self, index: int):
+        """Return (width, height) of a level without reading its tiles."""
+        width, height, offset = self.table[index]
+        return width, height
+
+    def view(self, index: int):
+        """Return a level's tiles as a read-only (height, width) view of the mapping.
+
+        This is a NumPy array when NumPy is installed and a memoryview otherwise.
+        """
+        # Imported here so loading levels for the game does not pay for importing NumPy
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        width, height, offset = self.table[index]
+        if numpy is not None:
+            return numpy.frombuffer(self.map, numpy.int8, width * height, offset).reshape(height, width)
+        return memoryview(self.map)[offset:offset + width * height].cast('b', (height, width))
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+"""Level archives"""
+
+# An archive is a zip file or a directory holding manifest.json and one JSON file of rows per level.
+#   The manifest lists every level's name, file, width, height, file size and SHA-256 checksum, so the
+#   archive can be opened and sized without reading any level.
+MANIFEST = 'manifest.json'
+ARCHIVE_VERSION = 1
+
+
+def write_archive(levels, path, names=None):
+    """Write a list of levels (lists of rows of tiles) as a level archive.
+
+    path is a zip file if it ends in .zip and a directory otherwise.
+    """
+    entries = []
+    files = {}
+    for index, level in enumerate(levels):
+        height = len(level)
+        width = len(level[0]) if height else 0
+        if any(len(row) != width for row in level):
+            raise ValueError("every row of a level must be the same length")
+        contents = json.dumps(level, separators=(',', ':')).encode()
+        filename = f'levels/{index + 1:04}.json'
+        files[filename] = contents
+        entries.append({
+            'name': names[index] if names else f'Level {index + 1}',
+            'file': filename,
+            'width': width,
+            'height': height,
+            'size': len(contents),
+            'checksum': hashlib.sha256(contents).hexdigest(),
+        })
+    files[MANIFEST] = json.dumps({'version': ARCHIVE_VERSION, 'levels': entries}, indent=1).encode()
+
+    if path.endswith('.zip'):
+        import zipfile
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for filename, contents in files.items():
+                archive.writestr(filename, contents)
+    else:
+        for filename, contents in files.items():
+            filename = os.path.join(path, filename)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'wb') as f:
+                f.write(contents)
+
+
+def level_footprint(level):
+    """Roughly how many bytes a level takes in memory, as rows or as a SparseLevel."""
+    if isinstance(level, SparseLevel):
+        # A list slot and a 3-tuple per run
+        return 64 * level.height + sum(72 * len(row_runs) for row_runs in level.runs)
+    # A list per row and a pointer per tile. Tiles are small ints, which Python shares.
+    return sum(56 + 8 * len(row) for row in level)
+
+
+class LevelArchive:
+    # A level archive opened for reading. Only the manifest is read up front. Levels are read, checked
+    #   against their checksum and parsed when they are first asked for, and kept in an LRU cache that
+    #   drops the least recently used levels once they take more than budget bytes.
+    # Like LevelPack, indexing returns a level as a list of rows, and sparse() returns a SparseLevel.
+    #   Both forms are cached separately. The cache is shared between threads, so levels can be
+    #   prepared in the background.
+    def __init__(self, path, budget=64 * 1024 * 1024):
+        self.path = path
+        self.budget = budget
+        self.zip = None
+        if path.endswith('.zip'):
+            # Imported here so games that load plain JSON or packs do not pay for importing zipfile
+            import zipfile
+            self.zip = zipfile.ZipFile(path)
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        manifest = json.loads(self._read(MANIFEST))
+        if manifest.get('version') != ARCHIVE_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {ARCHIVE_VERSION} level archive")
+        self.levels = manifest['levels']
+        self.max_height = max((entry['height'] for entry in self.levels), default=0)
+
+    def _read(self, filename):
+        if self.zip is not None:
+            return self.zip.read(filename)
+        with open(os.path.join(self.path, filename), 'rb') as f:
+            return f.read()
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __getitem__(self, index: int):
+        return self._get(index, False)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def sparse(self, index: int):
+        """Return a level as a SparseLevel."""
+        return self._get(index, True)
+
+    def size(self, index: int):
+        """Return (width, height) of a level without reading its tiles."""
+        entry = self.levels[index]
+        return entry['width'], entry['height']
+
+    def name(self, index: int):
+        return self.levels[index]['name']
+
+    def _get(self, index: int, sparse: bool):
+        entry = self.levels[index]
+        key = (entry['file'], sparse)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key][0]
+            contents = self._read(entry['file'])
+            if hashlib.sha256(contents).hexdigest() != entry['checksum']:
+                raise ValueError(f"{entry['file']} in {self.path} does not match its checksum")
+            level = json.loads(contents)
+            if sparse:
+                level = SparseLevel.from_rows(level)
+            footprint = level_footprint(level)
+            self.cache[key] = (level, footprint)
+            self.cached_bytes += footprint
+            # Always keep the level just loaded, even if it is over the budget on its own
+            while self.cached_bytes > self.budget and len(self.cache) > 1:
+                old_level, old_footprint = self.cache.popitem(last=False)[1]
+                self.cached_bytes -= old_footprint
+            return level
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_levels(path):
+    """Open a level pack (.gdl) or level archive (.zip or directory) by its path."""
+    if path.endswith('.gdl'):
+        return LevelPack(path)
+    return LevelArchive(path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    if sys.argv[2].endswith('.gdl'):
+        convert(sys.argv[1], sys.argv[2])
+    else:
+        with open(sys.argv[1], 'r') as f:
+            write_archive(json.load(f), sys.argv[2])
@@ -0,0 +1,239 @@
+"""Compact replays of a run, and checking them in bulk.
+
+A run is decided by its level and the ticks space was pressed and released at, so that is all a replay
+stores. Check replays against the levels with:
+    python replay.py [--data FILE] [--workers W] [--max-ticks T] REPLAY ...
+"""
+import argparse
+import hashlib
+import struct
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from levels import SparseLevel
+
+# A replay is the magic, a version byte and the first CHECKSUM_SIZE bytes of the level checksum, followed
+#   by varints: level number, result, end tick, number of edges and the edges.
+# Each edge is the ticks since the previous edge (or the start) times two, plus one for a press.
+MAGIC = b'GDR'
+VERSION = 1
+CHECKSUM_SIZE = 16
+RESULTS = {False: 0, True: 1, None: 2}
+# Replays claiming to be longer than this are not played, so a made up end tick cannot keep a verifier
+#   busy. 30 minutes at 60 ticks a second.
+MAX_TICKS = 30 * 60 * 60
+
+# Verification statuses
+VALID = 'valid'
+MISMATCH = 'mismatch'  # The replay does not end the way it claims
+WRONG_LEVEL = 'wrong level'  # The level has changed since the replay was recorded
+CORRUPT = 'corrupt'  # The replay could not be decoded, or is longer than the verifier allows
+
+
+def level_checksum(level):
+    """Return the SHA-256 of a level's tiles (rows or a SparseLevel), the same however it is stored."""
+    if isinstance(level, SparseLevel):
+        level = level.to_rows()
+    height = len(level)
+    width = len(level[0]) if height else 0
+    digest = hashlib.sha256(struct.pack('<II', width, height))
+    for row in level:
+        digest.update(struct.pack(f'<{width}b', *row))
+    return digest.digest()
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, position: int):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+class Replay:
+    # level: the level number. checksum: the level's checksum, cut to CHECKSUM_SIZE bytes.
+    # result and ticks: player.result and the tick the run ended on, as the run claims them.
+    # edges: (tick, jump) for every tick space was pressed (True) or released (False) at, as recorded in
+    #   Simulation.edges.
+    def __init__(self, level: int, checksum: bytes, result, ticks: int, edges: list):
+        self.level = level
+        self.checksum = checksum[:CHECKSUM_SIZE]
+        self.result = result
+        self.ticks = ticks
+        self.edges = edges
+
+    @classmethod
+    def from_simulation(cls, simulation, level: int):
+        """Make a replay of the run a Simulation has played so far."""
+        return cls(level, level_checksum(simulation.world.data), simulation.player.result, simulation.tick,
+                   list(simulation.edges))
+
+    @classmethod
+    def from_inputs(cls, level: int, data, inputs, max_ticks=None, bottom=None):
+        """Make a replay by playing per tick inputs, such as a witness from solver.py, through a level.
+
+        bottom is as for World.
+        """
+        # Imported here so the game can import this module for recording without importing itself again
+        import geometry_dash_1_1 as gd
+        simulation = gd.Simulation(data, bottom=bottom)
+        simulation.run(inputs, max_ticks)
+        return cls.from_simulation(simulation, level)
+
+    def encode(self):
+        out = bytearray(MAGIC)
+        out.append(VERSION)
+        out += self.checksum
+        for value in (self.level, RESULTS[self.result], self.ticks, len(self.edges)):
+            _write_varint(out, value)
+        last = 0
+        for tick, jump in self.edges:
+            _write_varint(out, (tick - last) * 2 + jump)
+            last = tick
+        return bytes(out)
+
+    @classmethod
+    def decode(cls, data: bytes):
+        """Read a replay made by encode(). Raises ValueError if it is not one."""
+        header = len(MAGIC) + 1
+        if data[:len(MAGIC)] != MAGIC or len(data) < header + CHECKSUM_SIZE or data[len(MAGIC)] != VERSION:
+            raise ValueError(f"not a version {VERSION} replay")
+        checksum = data[header:header + CHECKSUM_SIZE]
+        position = header + CHECKSUM_SIZE
+        try:
+            level, position = _read_varint(data, position)
+            result, position = _read_varint(data, position)
+            ticks, position = _read_varint(data, position)
+            count, position = _read_varint(data, position)
+            edges = []
+            tick = 0
+            for _ in range(count):
+                value, position = _read_varint(data, position)
+                tick += value >> 1
+                edges.append((tick, bool(value & 1)))
+        except IndexError:
+            raise ValueError("replay is cut short") from None
+        results = {code: result for result, code in RESULTS.items()}
+        if result not in results or position != len(data):
+            raise ValueError("replay is malformed")
+        return cls(level, checksum, results[result], ticks, edges)
+
+    def inputs(self):
+        """Yield the input for every tick up to the end tick, as Simulation.step takes it."""
+        edges = iter(self.edges)
+        edge = next(edges, None)
+        for tick in range(self.ticks):
+            jump = None
+            # Only the last edge of a tick counts
+            while edge is not None and edge[0] == tick:
+                jump = edge[1]
+                edge = next(edges, None)
+            yield jump
+
+
+Verification = namedtuple('Verification', ['status', 'outcome'])
+
+
+class Verifier:
+    # Plays replays through their levels headlessly. Each level's Simulation is built once and reset for
+    #   every replay of it, so checking many replays of the same level costs little more than their ticks.
+    # A replay of an unfinished run (result None) is valid if the player is still playing at its end
+    #   tick. That is all it proves, so rank only wins.
+    def __init__(self, data, max_ticks=MAX_TICKS):
+        import geometry_dash_1_1 as gd
+        self.data = data
+        self.max_ticks = max_ticks
+        # Where players die falling in the game, worked out from the whole pack
+        self.bottom = gd.screen_height(data)
+        self.levels = {}
+
+    def _level(self, level: int):
+        if level not in self.levels:
+            import geometry_dash_1_1 as gd
+            if level < 1:
+                raise IndexError(level)
+            level_data = self.data[level - 1]
+            self.levels[level] = (gd.Simulation(level_data, bottom=self.bottom),
+                                  level_checksum(level_data)[:CHECKSUM_SIZE])
+        return self.levels[level]
+
+    def verify(self, replay):
+        """Check that a Replay, or an encoded one, ends with the result and tick it claims."""
+        if not isinstance(replay, Replay):
+            try:
+                replay = Replay.decode(replay)
+            except ValueError:
+                return Verification(CORRUPT, None)
+        if replay.ticks > self.max_ticks:
+            return Verification(CORRUPT, None)
+        try:
+            simulation, checksum = self._level(replay.level)
+        except IndexError:
+            return Verification(WRONG_LEVEL, None)
+        if checksum != replay.checksum:
+            return Verification(WRONG_LEVEL, None)
+        simulation.reset()
+        outcome = simulation.run(replay.inputs(), replay.ticks)
+        if outcome.result != replay.result or outcome.tick != replay.ticks:
+            return Verification(MISMATCH, outcome)
+        return Verification(VALID, outcome)
+
+
+_verifier = None
+
+
+def _start_worker(data_filename, max_ticks):
+    global _verifier
+    import geometry_dash_1_1 as gd
+    _verifier = Verifier(gd.get_data(data_filename), max_ticks)
+
+
+def _verify_in_worker(replay):
+    return _verifier.verify(replay)
+
+
+def verify_all(replays, data_filename=None, workers=None, chunksize=64, max_ticks=MAX_TICKS):
+    """Verify encoded replays in a process pool, yielding a Verification for each in order.
+
+    Each worker loads the levels from data_filename (get_data's default if None) once.
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=_start_worker,
+                             initargs=(data_filename, max_ticks)) as executor:
+        yield from executor.map(_verify_in_worker, replays, chunksize=chunksize)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that replays end the way they claim.")
+    parser.add_argument('replays', nargs='+', help="replay files")
+    parser.add_argument('--data', default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-ticks', type=int, default=MAX_TICKS, help="longest replay to play")
+    args = parser.parse_args()
+
+    def read(filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    verifications = verify_all(map(read, args.replays), args.data, args.workers, max_ticks=args.max_ticks)
+    counts = {}
+    for filename, verification in zip(args.replays, verifications):
+        counts[verification.status] = counts.get(verification.status, 0) + 1
+        if verification.status != VALID:
+            print(f"{filename}: {verification.status}")
+    print(", ".join(f"{count} {status}" for status, count in counts.items()))
+    return 0 if counts.keys() <= {VALID} else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
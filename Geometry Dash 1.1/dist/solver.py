@@ -0,0 +1,137 @@
+"""Check that every level can be completed.
+
+Usage: python solver.py [--data FILE] [--max-ticks T] [--max-states S] [--workers W] [--out FILE] [LEVEL ...]
+"""
+import argparse
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import geometry_dash_1_1 as gd
+
+SOLVABLE = 'solvable'
+UNSOLVABLE = 'unsolvable'
+UNKNOWN = 'unknown'
+INVALID = 'invalid'
+
+
+def _capture(simulation):
+    # player.jump is cleared because the search sets it before every tick, so states that only
+    #   differ in it are the same state
+    simulation.player.jump = False
+    return simulation.world.snapshot()
+
+
+def solve(data: list, max_ticks=10000, max_states=1000000, bottom=None):
+    """Search jump timings for a way from the player's spawn to an end portal.
+
+    Returns (status, inputs). inputs is the witness, one True (space held) or False (space released)
+    per tick, when status is SOLVABLE. UNSOLVABLE means every reachable state was searched without
+    finding a win; UNKNOWN means max_ticks or max_states ran out first. bottom is as for World.
+    """
+    if not any(0 in row for row in data):
+        return INVALID, None
+    if not any(7 in row for row in data):
+        return UNSOLVABLE, None
+
+    simulation = gd.Simulation(data, bottom=bottom)
+    start = _capture(simulation)
+    # Breadth first, so the witness is the fastest completion. Each state remembers the state and the
+    #   input it was reached from.
+    parents = {start: None}
+    queue = deque([(start, 0)])
+    exhausted = True
+
+    while queue:
+        state, tick = queue.popleft()
+        if tick >= max_ticks:
+            exhausted = False
+            continue
+        # Try not jumping first, so the witness only presses space when it has to
+        for jump in (False, True):
+            simulation.world.restore(state)
+            simulation.player.jump = jump
+            simulation.player.update()
+            if simulation.player.result is False:
+                continue
+            next_state = _capture(simulation)
+            if next_state in parents:
+                continue
+            parents[next_state] = (state, jump)
+            if simulation.player.result is True:
+                return SOLVABLE, _witness(parents, next_state)
+            if len(parents) >= max_states:
+                return UNKNOWN, None
+            queue.append((next_state, tick + 1))
+
+    return (UNSOLVABLE if exhausted else UNKNOWN), None
+
+
+def _witness(parents, state):
+    inputs = []
+    while parents[state] is not None:
+        state, jump = parents[state]
+        inputs.append(jump)
+    inputs.reverse()
+    return inputs
+
+
+def verify(data: list, inputs, bottom=None):
+    """Replay a witness and check that it completes the level."""
+    return gd.simulate(data, inputs, len(inputs), bottom).result is True
+
+
+def _check_level(job):
+    level, data, max_ticks, max_states, bottom = job
+    status, inputs = solve(data, max_ticks, max_states, bottom)
+    if status == SOLVABLE and not verify(data, inputs, bottom):
+        status = UNKNOWN
+        inputs = None
+    return level, status, inputs
+
+
+def check_levels(levels: dict, max_ticks=10000, max_states=1000000, workers=None, bottom=None):
+    """Solve {level number: level data} in a process pool, yielding (level, status, inputs).
+
+    Pass screen_height() of the whole pack as bottom so the levels are played as the game plays them.
+    Workers do not share the game's settings, so it goes with every job.
+    """
+    jobs = [(level, data, max_ticks, max_states, bottom) for level, data in levels.items()]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_check_level, jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that levels can be completed.")
+    parser.add_argument('levels', nargs='*', type=int, help="level numbers, all levels by default")
+    parser.add_argument('--data', default=None)
+    parser.add_argument('--max-ticks', type=int, default=10000)
+    parser.add_argument('--max-states', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', help="write the witness inputs of solvable levels to this JSON file")
+    args = parser.parse_args()
+
+    data = gd.get_data(args.data)
+    numbers = args.levels or range(1, len(data) + 1)
+    levels = {level: data[level - 1] for level in numbers}
+
+    witnesses = {}
+    failed = False
+    bottom = gd.screen_height(data)
+    for level, status, inputs in check_levels(levels, args.max_ticks, args.max_states, args.workers, bottom):
+        if status == SOLVABLE:
+            presses = [tick for tick, jump in enumerate(inputs) if jump and (tick == 0 or not inputs[tick - 1])]
+            print(f"Level {level}: {status} in {len(inputs)} ticks, press space at ticks {presses}")
+            witnesses[level] = inputs
+        else:
+            print(f"Level {level}: {status}")
+            failed = True
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(witnesses, f)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
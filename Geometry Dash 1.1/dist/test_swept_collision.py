@@ -0,0 +1,66 @@
+"""Tests for moves too fast for Player.update's plain collision tests. Run with python -m pytest."""
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+import pytest
+
+import geometry_dash_1_1 as gd
+
+HEIGHT = 12
+
+
+def fast_move(gravity: int, vel_y: float, max_step=None):
+    # One tick from y 300 between a ceiling and a floor of blocks, much further than a tile
+    rows = [[-1] * 20 for _ in range(HEIGHT)]
+    rows[0] = [1] * 20
+    rows[HEIGHT - 1] = [1] * 20
+    rows[5][1] = 0
+    player = gd.Simulation(rows).player
+    player.max_step = max_step
+    player.rect.y = 300
+    if gravity < 0:
+        player._change_gravity()
+    player.vel_y = vel_y - player.gravity
+    player.update()
+    return player
+
+
+CEILING = gd.TILE_SIZE
+FLOOR = (HEIGHT - 1) * gd.TILE_SIZE
+
+
+@pytest.mark.parametrize('gravity, vel_y, stop, landed', [
+    (1, 300, 'floor', True),
+    (1, -300, 'ceiling', False),
+    (-1, -300, 'ceiling', True),
+    (-1, 300, 'floor', False),
+])
+def test_fast_move_stops_at_first_block(gravity, vel_y, stop, landed):
+    player = fast_move(gravity, vel_y)
+    if stop == 'ceiling':
+        assert player.rect.top == CEILING
+    else:
+        assert player.rect.bottom == FLOOR
+    assert player.in_air is not landed
+    assert player.result is None
+
+
+def test_sweep_finds_a_tile_passed_through():
+    rect = pygame.Rect(0, 0, 10, 10)
+    assert gd.sweep(rect, pygame.Rect(0, 100, 10, 10), pygame.Rect(0, 50, 10, 5)) == pytest.approx(0.4)
+    assert gd.sweep(rect, pygame.Rect(0, 100, 10, 10), pygame.Rect(20, 50, 10, 5)) is None
+
+
+@pytest.mark.parametrize('max_step', [None, 10])
+def test_win_is_not_undone_by_a_later_sub_step(max_step):
+    simulation = gd.Simulation([[0, -1, 7, -1, 1]])
+    simulation.player.speed = 300
+    simulation.player.max_step = max_step
+    simulation.step(None)
+    assert simulation.player.result is True
+
+
+def test_sub_steps_end_where_one_step_does():
+    assert fast_move(1, 80, max_step=8).rect.topleft == fast_move(1, 80).rect.topleft